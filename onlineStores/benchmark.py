@@ -0,0 +1,128 @@
+"""
+Бенчмарки: python manage.py benchmark [сценарий ...] [--output results.json]
+
+Сценарии регистрируются декоратором @register в модулях <app>/benchmarks.py
+и запускаются на отдельной тестовой базе, рабочие данные не трогаются.
+Результат — JSON, который можно сравнивать между коммитами:
+python manage.py benchmark --compare baseline.json
+"""
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+scenarios = {}
+
+
+def register(name):
+    def decorator(func):
+        scenarios[name] = func
+        return func
+    return decorator
+
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """
+    Латентности в миллисекундах.
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(sample * 1000 for sample in samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'p50_ms': round(percentile(ordered, 0.50), 3),
+        'p95_ms': round(percentile(ordered, 0.95), 3),
+        'p99_ms': round(percentile(ordered, 0.99), 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+class Recorder:
+    """
+    Копит латентность и число SQL-запросов для серии одинаковых операций.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.queries = []
+
+    @contextmanager
+    def measure(self):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            yield
+            self.samples.append(time.perf_counter() - start)
+        self.queries.append(len(captured))
+
+    def summary(self):
+        result = summarize(self.samples)
+        if self.queries:
+            result['queries_mean'] = round(statistics.fmean(self.queries), 2)
+            result['queries_max'] = max(self.queries)
+        return result
+
+
+def run(func, repeat, warmup=1):
+    recorder = Recorder()
+    for _ in range(warmup):
+        func()
+    for _ in range(repeat):
+        with recorder.measure():
+            func()
+    return recorder.summary()
+
+
+@contextmanager
+def benchmark_environment():
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def reset_database():
+    call_command('flush', interactive=False, verbosity=0)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'queries_mean')
+
+
+def compare(baseline, current, path=()):
+    """
+    Пары значений COMPARED_METRICS из двух прогонов: [(путь, метрика, было, стало), ...].
+    Сравниваются только замеры, которые есть в обоих результатах.
+    """
+    rows = []
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            if isinstance(old, dict):
+                rows += compare(old, value, path + (key,))
+        elif key in COMPARED_METRICS and isinstance(old, (int, float)):
+            rows.append(('.'.join(path), key, old, value))
+    return rows
@@ -0,0 +1,115 @@
+"""
+Структурированные логи: JSON в одну строку, request ID в каждой записи
+и запись в поток из отдельного потока через очередь, чтобы запрос не ждал I/O.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import uuid
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra= и попадает в JSON
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+class RequestIdMiddleware:
+    """
+    Берёт X-Request-ID из запроса (например, от балансировщика) или генерирует новый
+    и возвращает его в ответе.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Проставляет record.request_id. Стоит на хендлере, поэтому срабатывает в потоке запроса.
+    """
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get() or '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    """
+    Кладёт записи в очередь; форматирование и запись в stream делает фоновый QueueListener.
+    По умолчанию пишет в stderr, как консольный логгер Django, чтобы не смешиваться
+    с выводом management-команд (например, JSON-отчётом benchmark).
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Форматирование откладываем до фонового потока, здесь только фиксируем текст сообщения
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.flush()
+        super().close()
@@ -0,0 +1,287 @@
+"""
+Метрики запросов: число и время SQL, время сериализации и рендера ответа
+и общая латентность по каждому view/action.
+
+- заголовок Server-Timing в каждом ответе (METRICS_SERVER_TIMING);
+- текстовый формат Prometheus на /metrics (METRICS_TOKEN);
+- лог медленных запросов с их SQL (METRICS_SLOW_REQUEST_MS).
+
+Счётчики живут в памяти процесса: каждый воркер отдаёт свои, Prometheus
+суммирует их по instance.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса. Лежит в request.metrics, пока запрос обрабатывается.
+    """
+
+    def __init__(self, capture_sql):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        # Сериализация (to_representation) вместе с SQL, который она делает по ленивым связям
+        self.serialize_seconds = 0.0
+        self.serialize_db_seconds = 0.0
+        self.serialized = False
+        self.serializing = False
+        self.capture_sql = capture_sql
+        self.sql = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += duration
+            if self.capture_sql and len(self.sql) < settings.METRICS_SLOW_SQL_LIMIT:
+                self.sql.append((duration, sql))
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+
+class Registry:
+    """
+    Агрегаты по ключу (view, method, status): счётчики и гистограмма латентности.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, metrics, total_seconds):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {
+                    'count': 0, 'seconds': 0.0, 'queries': 0, 'db_seconds': 0.0, 'render_seconds': 0.0,
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'serialize_count': 0, 'serialize_seconds': 0.0, 'serialize_buckets': [0] * len(DURATION_BUCKETS),
+                }
+            series['count'] += 1
+            series['seconds'] += total_seconds
+            series['queries'] += metrics.queries
+            series['db_seconds'] += metrics.db_seconds
+            series['render_seconds'] += metrics.render_seconds
+            add_to_buckets(series['buckets'], total_seconds)
+            # Гистограмма сериализации — только по ответам, которые её проходили (не из кэша)
+            if metrics.serialized:
+                series['serialize_count'] += 1
+                series['serialize_seconds'] += metrics.serialize_seconds
+                add_to_buckets(series['serialize_buckets'], metrics.serialize_seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                labels: dict(series, buckets=list(series['buckets']), serialize_buckets=list(series['serialize_buckets']))
+                for labels, series in self.series.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+def add_to_buckets(buckets, seconds):
+    index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+    if index < len(DURATION_BUCKETS):
+        buckets[index] += 1
+
+
+registry = Registry()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics = RequestMetrics(capture_sql=settings.METRICS_SLOW_REQUEST_MS > 0)
+        request.metrics = metrics
+        with ExitStack() as stack:
+            # Обёртка ставится на объект соединения, само подключение к базе не открывается
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.execute_wrapper))
+            response = self.get_response(request)
+
+        total = metrics.total_seconds
+        labels = (view_label(request), request.method, str(response.status_code))
+        registry.observe(labels, metrics, total)
+
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(metrics, total)
+        if metrics.capture_sql and total * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            log_slow_request(request, labels, metrics, total)
+        return response
+
+
+def server_timing(metrics, total):
+    # SQL внутри сериализации входит и в db, и в serialize — из app вычитаем его один раз
+    serialize_own = metrics.serialize_seconds - metrics.serialize_db_seconds
+    app = max(total - metrics.db_seconds - serialize_own - metrics.render_seconds, 0)
+    return ', '.join([
+        f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries"',
+        f'serialize;dur={metrics.serialize_seconds * 1000:.1f}',
+        f'render;dur={metrics.render_seconds * 1000:.1f}',
+        f'app;dur={app * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+def log_slow_request(request, labels, metrics, total):
+    sql = '\n'.join(f'  {duration * 1000:.1f} ms: {statement}' for duration, statement in metrics.sql)
+    logger.warning(
+        'Медленный запрос %s %s (%s): %.1f ms, %d SQL за %.1f ms\n%s',
+        request.method, request.get_full_path(), labels[0], total * 1000, metrics.queries,
+        metrics.db_seconds * 1000, sql,
+    )
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer, который записывает время рендера в request.metrics.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            request = (renderer_context or {}).get('request')
+            metrics = getattr(request, 'metrics', None)
+            if metrics is not None:
+                metrics.render_seconds += time.perf_counter() - start
+
+
+@contextmanager
+def timed_serialization(request):
+    """
+    Записывает время сериализации в request.metrics. Вложенные вызовы .data
+    (сериализатор внутри SerializerMethodField) отдельно не считаются.
+    """
+    metrics = getattr(request, 'metrics', None)
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    db_before = metrics.db_seconds
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_seconds += time.perf_counter() - start
+        metrics.serialize_db_seconds += metrics.db_seconds - db_before
+        metrics.serialized = True
+        metrics.serializing = False
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with timed_serialization(self.context.get('request')):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Примесь к сериализаторам ответов: время .data попадает в Server-Timing (serialize)
+    и в гистограмму http_request_serialize_seconds. Для many=True в Meta нужен
+    list_serializer_class = TimedListSerializer.
+    """
+
+    @property
+    def data(self):
+        with timed_serialization(self.context.get('request')):
+            return super().data
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(snapshot):
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def label_text(labels, **extra):
+        view, method, status = labels
+        pairs = [('view', view), ('method', method), ('status', status)] + list(extra.items())
+        return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+    def histogram(name, help_text, prefix):
+        family(name, 'histogram', help_text)
+        for labels, series in sorted(snapshot.items()):
+            total = series[f'{prefix}count']
+            if not total:
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, series[f'{prefix}buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label_text(labels, le=str(bound))}}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text(labels, le="+Inf")}}} {total}')
+            lines.append(f'{name}_sum{{{label_text(labels)}}} {series[f"{prefix}seconds"]:.6f}')
+            lines.append(f'{name}_count{{{label_text(labels)}}} {total}')
+
+    histogram('http_request_duration_seconds', 'Латентность запроса.', '')
+    histogram('http_request_serialize_seconds', 'Время сериализации ответа (с SQL по ленивым связям).', 'serialize_')
+
+    for name, key, help_text in (
+        ('http_request_db_queries_total', 'queries', 'Число SQL-запросов.'),
+        ('http_request_db_seconds_total', 'db_seconds', 'Время в SQL.'),
+        ('http_request_render_seconds_total', 'render_seconds', 'Время рендера ответа.'),
+    ):
+        family(name, 'counter', help_text)
+        for labels, series in sorted(snapshot.items()):
+            value = series[key]
+            lines.append(f'{name}{{{label_text(labels)}}} {value:.6f}' if isinstance(value, float)
+                         else f'{name}{{{label_text(labels)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus. Если задан METRICS_TOKEN, нужен
+    заголовок Authorization: Bearer <токен>; без токена эндпоинт есть только при DEBUG.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(render_prometheus(registry.snapshot()), content_type='text/plain; version=0.0.4')
@@ -12,7 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import config, Csv
+from boto3.s3.transfer import TransferConfig
 from corsheaders.defaults import default_headers
 
 import os
@@ -52,9 +53,12 @@ INSTALLED_APPS = [
     'storages',
     'drf_spectacular',
     'drf_spectacular_sidecar',
+    'djcelery_email',
 ]
 
 MIDDLEWARE = [
+    'onlineStores.logs.RequestIdMiddleware',
+    'onlineStores.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -88,11 +92,109 @@ WSGI_APPLICATION = 'onlineStores.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql — PostgreSQL (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT),
+# иначе файл SQLite. Тесты идут на той базе, что настроена.
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # Пул соединений psycopg 3 (Django 5.1+). С пулом соединение возвращается в пул
+    # после запроса, поэтому CONN_MAX_AGE должен быть 0; без пула соединение живёт CONN_MAX_AGE секунд
+    DB_POOL = config('DB_POOL', default=False, cast=bool)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='onlinestores'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            # Проверять переиспользуемое соединение перед запросом, а не падать на оборванном
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                    'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                    'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+                },
+            } if DB_POOL else {},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи, прежде чем упасть с "database is locked"
+                'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+                # Транзакция сразу берёт блокировку записи: без взаимоблокировки при повышении чтения до записи
+                'transaction_mode': 'IMMEDIATE',
+                # WAL: чтение не ждёт записи; synchronous=NORMAL в WAL безопасен и не делает fsync на каждый коммит
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000'
+                ),
+            },
+        }
+    }
+
+
+# Cache
+# Если задан REDIS_URL — общий кэш в Redis, иначе локальная память процесса.
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Сколько секунд держать закэшированные страницы каталога
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+
+
+# Полнотекстовый поиск по каталогу
+# Пусто — бэкенд выбирается по базе: SQLite FTS5 или PostgreSQL tsvector
+
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='')
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=500, cast=int)
+
+
+# Celery
+# Без брокера задачи выполняются сразу в процессе (eager), этого хватает для разработки.
+# В проде: CELERY_BROKER_URL=redis://... и отдельный воркер `celery -A onlineStores worker`.
+
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='')
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not CELERY_BROKER_URL, cast=bool)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Периодические задачи для `celery -A onlineStores beat`
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-email-codes': {
+        'task': 'users.tasks.purge_expired_email_codes',
+        'schedule': 60 * 60,
+    },
+    'requeue-pending-webhook-events': {
+        'task': 'shop.tasks.requeue_pending_webhook_events',
+        'schedule': 5 * 60,
+    },
+    'purge-unfinalized-uploads': {
+        'task': 'shop.tasks.purge_unfinalized_uploads',
+        'schedule': 60 * 60,
+    },
 }
 
 
@@ -141,15 +243,41 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-    'ROTATE_REFRESH_TOKENS': False,
-    'BLACKLIST_AFTER_ROTATION': True,
+    # Ротацию и чёрный список в кэше делает users/tokens.py (эндпоинт auth/refresh/),
+    # приложение token_blacklist с его таблицами не нужно
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': False,
     'UPDATE_LAST_LOGIN': False,
 }
+# Роль и is_staff берутся из claims токена без запроса User (users/authentication.py)
+JWT_CLAIMS_AUTH = config('JWT_CLAIMS_AUTH', default=True, cast=bool)
+# Сколько секунд хранить группы пользователя для проверок прав (users/roles.py)
+ROLES_CACHE_TIMEOUT = config('ROLES_CACHE_TIMEOUT', default=60 * 60, cast=int)
 
 
 REPOSITORY = config('REPOSITORY', default='default_value')
 
-EMAIL_BACKEND = 'users.email_backend.CustomEmailBackend'
+# Письма ставятся в очередь Celery (djcelery_email), воркер отправляет их пачками
+# через CustomEmailBackend с переиспользуемым SMTP-соединением
+EMAIL_BACKEND = 'djcelery_email.backends.CeleryEmailBackend'
+CELERY_EMAIL_BACKEND = 'users.email_backend.CustomEmailBackend'
+CELERY_EMAIL_CHUNK_SIZE = config('CELERY_EMAIL_CHUNK_SIZE', default=50, cast=int)
+CELERY_EMAIL_TASK_CONFIG = {
+    'queue': config('CELERY_EMAIL_QUEUE', default='celery'),
+    'ignore_result': True,
+}
+# Одноразовые коды входа (users/otp.py): время жизни (сек), число попыток ввода,
+# лимиты запросов кода на email и IP и подтверждений с одного IP за окно OTP_RATE_WINDOW (сек)
+OTP_CODE_TTL = config('OTP_CODE_TTL', default=300, cast=int)
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+OTP_RATE_WINDOW = config('OTP_RATE_WINDOW', default=600, cast=int)
+OTP_EMAIL_LIMIT = config('OTP_EMAIL_LIMIT', default=5, cast=int)
+OTP_IP_LIMIT = config('OTP_IP_LIMIT', default=30, cast=int)
+OTP_CONFIRM_IP_LIMIT = config('OTP_CONFIRM_IP_LIMIT', default=60, cast=int)
+
+# Сколько секунд соединение может простаивать без проверки NOOP перед следующей отправкой
+EMAIL_CONNECTION_MAX_IDLE = config('EMAIL_CONNECTION_MAX_IDLE', default=30, cast=int)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
 EMAIL_HOST = 'smtp.mail.ru'
 EMAIL_PORT = 465
 EMAIL_USE_SSL = True
@@ -164,11 +292,54 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'onlineStores.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Логи (onlineStores/logs.py): JSON или текст, request ID в каждой записи, запись в stderr через очередь (stdout остаётся выводу команд)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='json')  # json | text
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'onlineStores.logs.RequestIdFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'onlineStores.logs.JsonFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'onlineStores.logs.QueueStreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['request_id'],
+        },
+    },
+    'root': {'handlers': ['console'], 'level': LOG_LEVEL},
+    'loggers': {
+        # Свои хендлеры Django (console при DEBUG, mail_admins) не нужны — всё идёт через root
+        'django': {'handlers': [], 'level': 'INFO', 'propagate': True},
+    },
 }
 
+# Метрики запросов (onlineStores/metrics.py): Server-Timing, /metrics для Prometheus, лог медленных запросов.
+# METRICS_SLOW_REQUEST_MS = 0 выключает лог; METRICS_SLOW_SQL_LIMIT — сколько SQL сохранять в запись лога.
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_SLOW_REQUEST_MS = config('METRICS_SLOW_REQUEST_MS', default=500, cast=int)
+METRICS_SLOW_SQL_LIMIT = config('METRICS_SLOW_SQL_LIMIT', default=50, cast=int)
+
+# Сколько секунд держать в кэше totalCount для курсорной пагинации (?withTotal=true)
+PAGINATION_COUNT_CACHE_TIMEOUT = config('PAGINATION_COUNT_CACHE_TIMEOUT', default=60, cast=int)
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'OnlineStores API',
     'DESCRIPTION': 'Документация API для интернет-магазина.',
@@ -243,6 +414,34 @@ AWS_S3_FILE_OVERWRITE = False
 AWS_S3_USE_SSL = False
 AWS_QUERYSTRING_AUTH = False
 AWS_DEFAULT_ACL = None
+# Если задан, URL картинок строятся от CDN (например, https://cdn.example.com) без обращения к хранилищу
+MEDIA_CDN_URL = config('MEDIA_CDN_URL', default='')
+# URL файлов запоминаются в памяти процесса (shop/media.py): время жизни (сек) и размер на одно хранилище
+MEDIA_URL_CACHE_TIMEOUT = config('MEDIA_URL_CACHE_TIMEOUT', default=24 * 60 * 60, cast=int)
+MEDIA_URL_CACHE_SIZE = config('MEDIA_URL_CACHE_SIZE', default=10000, cast=int)
+# Файлы больше порога грузятся в S3 multipart-загрузкой, части уходят параллельно
+AWS_S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=config('AWS_S3_MULTIPART_THRESHOLD', default=8 * 1024 * 1024, cast=int),
+    multipart_chunksize=config('AWS_S3_MULTIPART_CHUNKSIZE', default=8 * 1024 * 1024, cast=int),
+    max_concurrency=config('AWS_S3_MULTIPART_CONCURRENCY', default=4, cast=int),
+)
+
+# Сколько файлов из одного запроса загружать в хранилище параллельно
+IMAGE_UPLOAD_WORKERS = config('IMAGE_UPLOAD_WORKERS', default=8, cast=int)
+
+# Прямая загрузка картинок в S3 по presigned POST: время жизни ссылки (сек), лимит размера, допустимые типы
+IMAGE_DIRECT_UPLOAD_EXPIRES = config('IMAGE_DIRECT_UPLOAD_EXPIRES', default=900, cast=int)
+IMAGE_DIRECT_UPLOAD_MAX_SIZE = config('IMAGE_DIRECT_UPLOAD_MAX_SIZE', default=20 * 1024 * 1024, cast=int)
+IMAGE_DIRECT_UPLOAD_CONTENT_TYPES = config(
+    'IMAGE_DIRECT_UPLOAD_CONTENT_TYPES', default='image/jpeg,image/png,image/webp', cast=Csv()
+)
+# Через сколько секунд незарегистрированные (без finalize) файлы прямой загрузки удаляются
+IMAGE_DIRECT_UPLOAD_CLEANUP_AGE = config('IMAGE_DIRECT_UPLOAD_CLEANUP_AGE', default=24 * 60 * 60, cast=int)
+
+# Рендишены картинок товаров: ширины (px) и форматы в порядке предпочтения.
+# avif пропускается, если Pillow собран без его поддержки.
+IMAGE_RENDITION_WIDTHS = config('IMAGE_RENDITION_WIDTHS', default='320,640,1024,1600', cast=Csv(int))
+IMAGE_RENDITION_FORMATS = config('IMAGE_RENDITION_FORMATS', default='avif,webp', cast=Csv())
 
 # Тинькофф Pay
 # Платеж через Тинькофф
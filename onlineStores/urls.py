@@ -19,6 +19,8 @@ from django.urls import path, include
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -30,6 +32,9 @@ urlpatterns = [
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/docs/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+
+    # Метрики для Prometheus
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import GoodCategory, Good, PaymentMethod, DeliveryMethod, Recipient, BasketItem, Checkout, CheckoutItem, Transaction
+
+from users import roles
+from .models import GoodCategory, Good, PaymentMethod, DeliveryMethod, Recipient, BasketItem, Checkout, CheckoutItem, Transaction, \
+    WebhookEvent
 
 
 @admin.register(GoodCategory)
@@ -18,7 +21,7 @@ class GoodAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        if request.user.is_superuser or request.user.role == 'admin':
+        if request.user.is_superuser or roles.has_role(request.user, roles.ADMIN):
             return qs
         return qs.filter(seller=request.user)
 
@@ -73,3 +76,11 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ['id', 'checkout', 'status', 'amount', 'created', 'updated']
     list_filter = ['status']
     autocomplete_fields = ['checkout']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'provider', 'event_key', 'status', 'attempts', 'received', 'processed']
+    list_filter = ['provider', 'status']
+    search_fields = ['event_key']
+    readonly_fields = ['provider', 'event_key', 'payload', 'received']
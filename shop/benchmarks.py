@@ -0,0 +1,462 @@
+import json
+import math
+import os
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock
+
+import boto3
+from django.core.cache import cache
+from django.core.files.storage import InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from onlineStores.benchmark import Recorder, register, run, summarize
+from users.claims import refresh_token_for
+from users.models import User
+from .media import clear_url_cache
+from .models import (
+    BasketItem, Checkout, CheckoutItem, DeliveryMethod, Good, GoodCategory, GoodImage, GoodImageRendition,
+    PaymentMethod, Recipient, Transaction, WebhookEvent,
+)
+from .search import get_backend as get_search_backend
+from .serializers import GoodListSerializer, GoodSerializer
+from .tasks import generate_thumbnail, process_webhook_event
+from .views import CustomPagination
+
+
+def seed_checkouts(count):
+    user = User.objects.create_user(email='bench-buyer@example.com')
+    recipient = Recipient.objects.create(
+        user=user, first_name='Иван', last_name='Иванов', address='Москва', zip_code='101000', phone='+70000000000',
+    )
+    payment_method = PaymentMethod.objects.create(title='Карта')
+    delivery_method = DeliveryMethod.objects.create(title='Курьер')
+    checkouts = Checkout.objects.bulk_create(
+        Checkout(
+            user=user, recipient=recipient, payment_method=payment_method, delivery_method=delivery_method,
+            payment_total=Decimal('1000'),
+        )
+        for _ in range(count)
+    )
+    return user, checkouts
+
+
+@register('webhook_burst')
+def webhook_burst(size=None):
+    """
+    Пачка уведомлений ЮKassa: каждое событие приходит трижды (ретраи провайдера).
+    Отдельно меряем приём вебхука и фоновую обработку событий.
+    """
+    payments = size or 300
+    _, checkouts = seed_checkouts(payments)
+    Transaction.objects.bulk_create(
+        Transaction(
+            checkout=checkout, amount=checkout.payment_total, provider_data={'id': f'pay-{checkout.pk}'},
+            provider_payment_id=f'pay-{checkout.pk}',
+        )
+        for checkout in checkouts
+    )
+
+    callbacks = [
+        json.dumps({
+            'event': 'payment.succeeded',
+            'object': {'id': f'pay-{checkout.pk}', 'status': 'succeeded'},
+        })
+        for checkout in checkouts
+        for _ in range(3)
+    ]
+    random.Random(0).shuffle(callbacks)
+
+    client = Client()
+    queued = []
+    ingest = Recorder()
+    with mock.patch.object(process_webhook_event, 'delay', side_effect=queued.append):
+        start = time.perf_counter()
+        for body in callbacks:
+            with ingest.measure():
+                client.post('/api/v1/payment/yookassa/webhook/', body, content_type='application/json')
+        ingest_seconds = time.perf_counter() - start
+
+    # Повтор ещё не обработанного события снова ставит его в очередь,
+    # поэтому дедупликацию проверяем по inbox, а не по числу постановок
+    unique_events = WebhookEvent.objects.count()
+    assert unique_events == payments, (unique_events, payments)
+
+    process = Recorder()
+    event_ids = list(dict.fromkeys(queued))
+    start = time.perf_counter()
+    for event_id in event_ids:
+        with process.measure():
+            process_webhook_event(event_id)
+    process_seconds = time.perf_counter() - start
+
+    return {
+        'callbacks': len(callbacks),
+        'enqueued': len(queued),
+        'unique_events': unique_events,
+        'paid_checkouts': Checkout.objects.filter(is_paid=True).count(),
+        'ingest': ingest.summary(),
+        'ingest_per_second': round(len(callbacks) / ingest_seconds, 1),
+        'process': process.summary(),
+        'process_per_second': round(len(event_ids) / process_seconds, 1),
+    }
+
+
+class LatencyS3Storage(S3Boto3Storage):
+    """
+    S3-хранилище, которое добавляет задержку к каждому запросу, — чтобы на локальной
+    заглушке без сети было видно, сколько съедают сетевые round-trip'ы.
+    """
+    latency = 0
+
+    @property
+    def connection(self):
+        connection = super().connection
+        if self.latency and not getattr(self._connections, 'latency_registered', False):
+            connection.meta.client.meta.events.register('before-sign.s3', lambda **kwargs: time.sleep(self.latency))
+            self._connections.latency_registered = True
+        return connection
+
+
+@contextmanager
+def s3_stand_in():
+    """
+    MinIO, если задан BENCHMARK_S3_ENDPOINT_URL, иначе moto в памяти процесса.
+    """
+    endpoint_url = os.environ.get('BENCHMARK_S3_ENDPOINT_URL')
+    if endpoint_url:
+        options = {
+            'bucket_name': os.environ.get('BENCHMARK_S3_BUCKET', 'benchmark'),
+            'endpoint_url': endpoint_url,
+            'access_key': os.environ.get('BENCHMARK_S3_ACCESS_KEY', 'minioadmin'),
+            'secret_key': os.environ.get('BENCHMARK_S3_SECRET_KEY', 'minioadmin'),
+        }
+        latency_ms = int(os.environ.get('BENCHMARK_S3_LATENCY_MS', 0))
+        mock_context = None
+    else:
+        from moto import mock_aws
+        options = {
+            'bucket_name': 'benchmark',
+            'endpoint_url': None,
+            'region_name': 'us-east-1',
+            'access_key': 'testing',
+            'secret_key': 'testing',
+        }
+        latency_ms = int(os.environ.get('BENCHMARK_S3_LATENCY_MS', 20))
+        mock_context = mock_aws()
+        mock_context.start()
+
+    try:
+        client = boto3.client(
+            's3', endpoint_url=options['endpoint_url'], region_name=options.get('region_name', 'us-east-1'),
+            aws_access_key_id=options['access_key'], aws_secret_access_key=options['secret_key'],
+        )
+        try:
+            client.create_bucket(Bucket=options['bucket_name'])
+        except client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+        storage = LatencyS3Storage(**options)
+        storage.latency = latency_ms / 1000
+        field = GoodImage._meta.get_field('image')
+        original = field.storage
+        field.storage = storage
+        try:
+            yield {'backend': 'minio' if endpoint_url else 'moto', 'latency_ms': latency_ms}
+        finally:
+            field.storage = original
+    finally:
+        if mock_context:
+            mock_context.stop()
+
+
+@register('image_upload')
+def image_upload(size=None):
+    """
+    Загрузка 1, 10 и 50 файлов в upload_image: последовательно (1 поток) и через пул потоков.
+    Построение превью выключено — меряем только запись в хранилище и вставку строк.
+    """
+    file_size = (size or 256) * 1024
+    repeat = 3
+    seller = User.objects.create_user(email='bench-seller@example.com', role='seller')
+    good = Good.objects.create(
+        name='Товар', price=Decimal('100'), category=GoodCategory.objects.create(title='Категория'), seller=seller,
+    )
+    client = APIClient()
+    client.force_authenticate(seller)
+    payload = os.urandom(file_size)
+
+    def upload(count):
+        files = [SimpleUploadedFile(f'{i}.jpg', payload, content_type='image/jpeg') for i in range(count)]
+        response = client.post(f'/api/v1/goods/{good.pk}/upload_image/', {'image': files}, format='multipart')
+        assert response.status_code == 200, response.content
+
+    results = {'file_kb': file_size // 1024}
+    with s3_stand_in() as stand_in, mock.patch.object(generate_thumbnail, 'delay'):
+        results.update(stand_in)
+        for count in (1, 10, 50):
+            timings = {}
+            for mode, workers in (('sequential', 1), ('parallel', None)):
+                overrides = {'IMAGE_UPLOAD_WORKERS': workers} if workers else {}
+                with override_settings(**overrides):
+                    samples = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        upload(count)
+                        samples.append(time.perf_counter() - start)
+                timings[mode] = summarize(samples)
+            timings['speedup'] = round(timings['sequential']['p50_ms'] / timings['parallel']['p50_ms'], 2)
+            results[f'{count}_files'] = timings
+    return results
+
+
+@contextmanager
+def in_memory_image_storage():
+    fields = [
+        GoodImage._meta.get_field('image'),
+        GoodImage._meta.get_field('thumbnail'),
+        GoodImageRendition._meta.get_field('file'),
+    ]
+    originals = [field.storage for field in fields]
+    storage = InMemoryStorage(base_url='https://media.example.com/')
+    for field in fields:
+        field.storage = storage
+    try:
+        yield storage
+    finally:
+        for field, original in zip(fields, originals):
+            field.storage = original
+
+
+def seed_catalog(count, images_per_good=4):
+    seller = User.objects.create_user(email='bench-catalog@example.com', role='seller')
+    category = GoodCategory.objects.create(title='Категория')
+    goods = Good.objects.bulk_create(
+        Good(name=f'Товар {i}', description='Подробное описание товара. ' * 20, price=Decimal('100') + i,
+             category=category, seller=seller)
+        for i in range(count)
+    )
+    images = GoodImage.objects.bulk_create(
+        GoodImage(good=good, image=f'goods/{good.pk}_{j}.jpg', thumbnail=f'goods/thumbs/thumb_{good.pk}_{j}.jpg',
+                  thumbnail_status='ready')
+        for good in goods
+        for j in range(images_per_good)
+    )
+    GoodImageRendition.objects.bulk_create(
+        GoodImageRendition(image=image, width=width, height=width, format=fmt,
+                           file=f'goods/renditions/{image.pk}_{width}.{fmt}')
+        for image in images
+        for width in (320, 640, 1024)
+        for fmt in ('avif', 'webp')
+    )
+    return goods
+
+
+@register('catalog_payload')
+def catalog_payload(size=None):
+    """
+    Страница каталога в полном (GoodSerializer) и компактном (GoodListSerializer) представлении:
+    размер JSON, время сериализации с рендером и число запросов.
+    Плюс холодный GET /catalog/ (без кэша ответов), который теперь отдаёт компактный список.
+    """
+    page_size = size or 50
+    seed_catalog(max(page_size, 200))
+    variants = {
+        'full': (GoodSerializer, Good.objects.select_related('category', 'seller').prefetch_related('images__renditions')),
+        'list': (GoodListSerializer, Good.objects.only('id', 'name', 'price').prefetch_related('images')),
+    }
+    renderer = JSONRenderer()
+    results = {'page_size': page_size}
+    with in_memory_image_storage():
+        for name, (serializer_class, queryset) in variants.items():
+            payload = {}
+
+            def render():
+                page = list(queryset.order_by('-id')[:page_size])
+                payload['body'] = renderer.render(serializer_class(page, many=True).data)
+
+            clear_url_cache()
+            results[name] = dict(run(render, repeat=50), bytes=len(payload['body']))
+
+        results['bytes_ratio'] = round(results['full']['bytes'] / results['list']['bytes'], 2)
+        results['speedup'] = round(results['full']['p50_ms'] / results['list']['p50_ms'], 2)
+
+        client = Client()
+        endpoint = Recorder()
+        for _ in range(50):
+            cache.clear()
+            with endpoint.measure():
+                client.get('/api/v1/catalog/')
+        results['catalog_endpoint_cold'] = endpoint.summary()
+    return results
+
+
+def auth_headers(user):
+    """
+    Заголовок с настоящим JWT, чтобы замер включал аутентификацию.
+    """
+    return {'HTTP_AUTHORIZATION': f'Bearer {refresh_token_for(user).access_token}'}
+
+
+def seed_shop(goods_count):
+    """
+    Магазин целиком: дерево категорий, продавцы с товарами и картинками,
+    покупатели с корзинами и заказами. Объёмы растут вместе с goods_count.
+    """
+    rng = random.Random(0)
+    roots = [GoodCategory.objects.create(title=f'Раздел {i}') for i in range(5)]
+    leaves = [
+        GoodCategory.objects.create(title=f'Категория {root.pk}.{i}', parent=root)
+        for root in roots
+        for i in range(max(1, goods_count // 100))
+    ]
+    sellers = User.objects.bulk_create(
+        User(email=f'seller{i}@example.com', role='seller') for i in range(5)
+    )
+    buyers = User.objects.bulk_create(
+        User(email=f'buyer{i}@example.com') for i in range(max(10, goods_count // 20))
+    )
+
+    goods = Good.objects.bulk_create(
+        Good(
+            name=f'Товар {i} {rng.choice(["смартфон", "ноутбук", "наушники", "чехол", "зарядка"])}',
+            description='Описание товара. ' * 10, price=Decimal(rng.randint(100, 100000)),
+            category=rng.choice(leaves), seller=sellers[i % len(sellers)],
+        )
+        for i in range(goods_count)
+    )
+    # bulk_create не шлёт сигналы — индекс поиска наполняем сами
+    search = get_search_backend()
+    for good in goods:
+        search.update(good)
+    images = GoodImage.objects.bulk_create(
+        GoodImage(good=good, image=f'goods/{good.pk}_{j}.jpg', thumbnail=f'goods/thumbs/thumb_{good.pk}_{j}.jpg',
+                  thumbnail_status='ready')
+        for good in goods
+        for j in range(3)
+    )
+    GoodImageRendition.objects.bulk_create(
+        GoodImageRendition(image=image, width=width, height=width, format='webp',
+                           file=f'goods/renditions/{image.pk}_{width}.webp')
+        for image in images
+        for width in (320, 640)
+    )
+
+    payment_method = PaymentMethod.objects.create(title='Карта')
+    delivery_method = DeliveryMethod.objects.create(title='Курьер')
+    recipients = Recipient.objects.bulk_create(
+        Recipient(user=buyer, first_name='Иван', last_name='Иванов', address='Москва', zip_code='101000',
+                  phone='+70000000000')
+        for buyer in buyers
+    )
+    BasketItem.objects.bulk_create(
+        BasketItem(user=buyer, good=good, count=rng.randint(1, 3))
+        for buyer in buyers
+        for good in rng.sample(goods, min(10, len(goods)))
+    )
+    checkouts = Checkout.objects.bulk_create(
+        Checkout(user=buyer, recipient=recipient, payment_method=payment_method, delivery_method=delivery_method,
+                 payment_total=Decimal('1000'))
+        for buyer, recipient in zip(buyers, recipients)
+        for _ in range(5)
+    )
+    CheckoutItem.objects.bulk_create(
+        CheckoutItem(checkout=checkout, good=good, count=1)
+        for checkout in checkouts
+        for good in rng.sample(goods, min(3, len(goods)))
+    )
+    return {'categories': roots + leaves, 'sellers': sellers, 'buyers': buyers, 'goods': goods}
+
+
+@register('shop_api')
+def shop_api(size=None):
+    """
+    Латентность (p50/p95/p99) и число запросов основных эндпоинтов магазина через тестовый клиент
+    с настоящими JWT. Каталог меряется и холодным (кэш сброшен), и тёплым.
+    """
+    goods_count = size or 1000
+    repeat = 50
+    shop = seed_shop(goods_count)
+    seller = auth_headers(shop['sellers'][0])
+    buyer = auth_headers(shop['buyers'][0])
+    leaf = shop['categories'][-1]
+    root = shop['categories'][0]
+    good = shop['goods'][len(shop['goods']) // 2]
+    # Пятая страница или последняя, если при маленьком --size страниц меньше
+    deep_page = max(1, min(5, math.ceil(goods_count / CustomPagination.page_size)))
+
+    endpoints = {
+        'catalog': ('/api/v1/catalog/', {}, {}),
+        'catalog_page_5': ('/api/v1/catalog/', {'page': deep_page}, {}),
+        'catalog_cursor': ('/api/v1/catalog/', {'pagination': 'cursor'}, {}),
+        'catalog_filtered': (
+            '/api/v1/catalog/', {'category': root.pk, 'include_descendants': 'true', 'ordering': '-price'}, {},
+        ),
+        'catalog_search': ('/api/v1/catalog/search/', {'q': 'смартфон'}, {}),
+        'catalog_detail': (f'/api/v1/catalog/{good.pk}/', {}, {}),
+        'category_goods': (f'/api/v1/good-categories/{leaf.pk}/goods/', {}, {}),
+        'goods': ('/api/v1/goods/', {}, seller),
+        'basket_items': ('/api/v1/me/basket-items/', {}, buyer),
+        'checkouts': ('/api/v1/checkouts/', {}, buyer),
+        'checkouts_cursor': ('/api/v1/checkouts/', {'pagination': 'cursor'}, buyer),
+    }
+    cached = {'catalog', 'catalog_page_5', 'catalog_filtered', 'catalog_search', 'catalog_detail'}
+
+    client = Client()
+    results = {'seeded': {'goods': goods_count, 'users': len(shop['sellers']) + len(shop['buyers'])}}
+    with in_memory_image_storage():
+        for name, (path, params, headers) in endpoints.items():
+            def request():
+                response = client.get(path, params, **headers)
+                assert response.status_code == 200, (name, response.status_code, response.content[:200])
+
+            cold = Recorder()
+            for _ in range(repeat):
+                cache.clear()
+                clear_url_cache()
+                with cold.measure():
+                    request()
+            results[name] = cold.summary()
+            if name in cached:
+                results[f'{name}_warm'] = run(request, repeat=repeat)
+    return results
+
+
+@register('seller_auth')
+def seller_auth(size=None):
+    """
+    Эндпоинты продавца с User из базы (JWT_CLAIMS_AUTH=False) и с ролью из claims токена:
+    разница в числе запросов — SELECT пользователя на каждый запрос.
+    """
+    goods_count = size or 200
+    repeat = 50
+    shop = seed_shop(goods_count)
+    seller = shop['sellers'][0]
+    headers = auth_headers(seller)
+    good = Good.objects.filter(seller=seller).first()
+
+    client = Client()
+    requests = {
+        'goods': lambda: client.get('/api/v1/goods/', **headers),
+        'goods_detail': lambda: client.get(f'/api/v1/goods/{good.pk}/', **headers),
+        'goods_update': lambda: client.patch(
+            f'/api/v1/goods/{good.pk}/', {'price': '100.00'}, content_type='application/json', **headers,
+        ),
+    }
+    results = {'seeded': {'goods': goods_count}}
+    with in_memory_image_storage():
+        for mode, claims_auth in (('db_user', False), ('claims', True)):
+            with override_settings(JWT_CLAIMS_AUTH=claims_auth):
+                for name, request in requests.items():
+                    def measured():
+                        response = request()
+                        assert response.status_code == 200, (name, response.status_code, response.content[:200])
+
+                    results[f'{name}_{mode}'] = run(measured, repeat=repeat)
+    return results
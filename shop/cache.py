@@ -0,0 +1,74 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+CATALOG = 'catalog'
+CATEGORIES = 'categories'
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def get_version(namespace):
+    """
+    Текущая версия пространства имён. Ключи кэша включают версию,
+    поэтому для инвалидации достаточно её увеличить — без перебора ключей.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Стартуем со времени, чтобы после вытеснения ключа версии не вернуть старые записи
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        return cache.get(key)
+
+
+def _stat_key(namespace, name):
+    return f'{namespace}:stats:{name}'
+
+
+def _count(namespace, name):
+    key = _stat_key(namespace, name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats(namespace):
+    hits = cache.get(_stat_key(namespace, 'hits'), 0)
+    misses = cache.get(_stat_key(namespace, 'misses'), 0)
+    return {
+        'version': get_version(namespace),
+        'hits': hits,
+        'misses': misses,
+    }
+
+
+def request_cache_key(namespace, request):
+    """
+    Ключ ответа: версия + хост + путь + отсортированные параметры запроса.
+    """
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = f'{request.get_host()}{request.path}?{query}'
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'{namespace}:{get_version(namespace)}:{digest}'
+
+
+def get_cached(namespace, key):
+    data = cache.get(key)
+    _count(namespace, 'misses' if data is None else 'hits')
+    return data
@@ -0,0 +1,67 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import GoodCategory
+
+
+def parse_param(params, name, cast):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = cast(value)
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValidationError({name: 'Некорректное значение.'})
+    # Decimal спокойно разбирает NaN и Infinity, а сравнение в запросе на них падает
+    if isinstance(value, Decimal) and not value.is_finite():
+        raise ValidationError({name: 'Некорректное значение.'})
+    return value
+
+
+class GoodFilterBackend(BaseFilterBackend):
+    """
+    Фильтры каталога: ?category=, ?include_descendants=true, ?seller=, ?price_min=, ?price_max=.
+    Комбинации покрываются составными индексами Good.Meta.indexes.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        category_id = parse_param(params, 'category', int)
+        if category_id is not None:
+            if params.get('include_descendants') in ('1', 'true'):
+                path = GoodCategory.objects.filter(pk=category_id).values_list('path', flat=True).first()
+                subtree = GoodCategory.objects.filter(path__startswith=path or f'{category_id}/')
+                queryset = queryset.filter(category__in=subtree.values('pk'))
+            else:
+                queryset = queryset.filter(category_id=category_id)
+
+        seller_id = parse_param(params, 'seller', int)
+        if seller_id is not None:
+            queryset = queryset.filter(seller_id=seller_id)
+
+        price_min = parse_param(params, 'price_min', Decimal)
+        if price_min is not None:
+            queryset = queryset.filter(price__gte=price_min)
+
+        price_max = parse_param(params, 'price_max', Decimal)
+        if price_max is not None:
+            queryset = queryset.filter(price__lte=price_max)
+
+        return queryset
+
+
+class GoodOrderingFilter(OrderingFilter):
+    """
+    ?ordering=price, -price, name, -created (сначала новые).
+    """
+    ordering_fields = ['price', 'name', 'created']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering:
+            # Добавляем id, чтобы страницы не «плыли» при одинаковых ценах
+            ordering = [*ordering, 'id']
+        return ordering
@@ -0,0 +1,68 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from onlineStores import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Запускает бенчмарки на временной тестовой базе и выводит результат в JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Имена сценариев (по умолчанию — все).')
+        parser.add_argument('--size', type=int, default=None, help='Масштаб данных для сценариев.')
+        parser.add_argument('--output', help='Файл для JSON с результатами.')
+        parser.add_argument('--list', action='store_true', help='Показать доступные сценарии.')
+        parser.add_argument('--compare', help='JSON прошлого прогона: вывести изменения p50/p95/запросов.')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('benchmarks')
+
+        if options['list']:
+            for name in sorted(benchmark.scenarios):
+                self.stdout.write(name)
+            return
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        names = options['scenarios'] or sorted(benchmark.scenarios)
+        unknown = set(names) - set(benchmark.scenarios)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+        results = {}
+        with benchmark.benchmark_environment():
+            for name in names:
+                self.stderr.write(f'{name}...')
+                benchmark.reset_database()
+                results[name] = benchmark.scenarios[name](size=options['size'])
+
+        report = json.dumps({
+            'revision': benchmark.git_revision(),
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'results': results,
+        }, indent=2, ensure_ascii=False)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+        else:
+            self.stdout.write(report)
+
+        if baseline:
+            self.write_comparison(baseline, results)
+
+    def write_comparison(self, baseline, results):
+        self.stderr.write(f"Сравнение с {baseline.get('revision') or 'прошлым прогоном'}:")
+        for path, metric, old, new in benchmark.compare(baseline.get('results', {}), results):
+            change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+            self.stderr.write(f'  {path} {metric}: {old} -> {new} ({change})')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.tasks import queue_pending_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь построение превью и рендишенов для картинок, у которых их ещё нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Повторить и картинки со статусом failed.')
+
+    def handle(self, *args, **options):
+        statuses = ('pending', 'failed') if options['failed'] else ('pending',)
+        queued = queue_pending_thumbnails(statuses)
+        self.stdout.write(f'Поставлено в очередь картинок: {queued}')
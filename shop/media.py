@@ -0,0 +1,69 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+
+# Имена файлов в хранилище не переиспользуются (AWS_S3_FILE_OVERWRITE = False),
+# поэтому URL по имени можно запоминать: новый файл — новое имя — новый ключ.
+_urls = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _object_key(storage, name):
+    # У S3 location — префикс ключа в бакете; у файловых хранилищ это путь на диске
+    location = (getattr(storage, 'location', '') or '') if hasattr(storage, 'bucket_name') else ''
+    return f"{location.strip('/')}/{name}" if location.strip('/') else name
+
+
+def _timeout(storage):
+    """
+    Подписанный URL живёт querystring_expire секунд — храним его вдвое меньше,
+    чтобы не отдать клиенту почти протухшую ссылку.
+    """
+    if getattr(storage, 'querystring_auth', False):
+        return min(settings.MEDIA_URL_CACHE_TIMEOUT, storage.querystring_expire // 2)
+    return settings.MEDIA_URL_CACHE_TIMEOUT
+
+
+def storage_url(storage, name):
+    """
+    URL файла: через MEDIA_CDN_URL без обращения к хранилищу,
+    иначе storage.url(), запомненный в памяти процесса.
+    """
+    if settings.MEDIA_CDN_URL:
+        return f"{settings.MEDIA_CDN_URL.rstrip('/')}/{quote(_object_key(storage, name))}"
+
+    now = time.monotonic()
+    with _lock:
+        urls = _urls.get(storage)
+        cached = urls.get(name) if urls is not None else None
+    if cached and cached[1] > now:
+        return cached[0]
+
+    url = storage.url(name)
+    with _lock:
+        urls = _urls.setdefault(storage, OrderedDict())
+        urls[name] = (url, now + _timeout(storage))
+        while len(urls) > settings.MEDIA_URL_CACHE_SIZE:
+            urls.popitem(last=False)
+    return url
+
+
+def file_url(file, request=None):
+    """
+    Абсолютный URL FieldFile или None, если файла нет.
+    """
+    if not file:
+        return None
+    url = storage_url(file.storage, file.name)
+    if request is not None and not urlsplit(url).netloc:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def clear_url_cache():
+    with _lock:
+        _urls.clear()
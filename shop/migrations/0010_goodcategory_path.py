@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    GoodCategory = apps.get_model("shop", "GoodCategory")
+    categories = {category.pk: category for category in GoodCategory.objects.all()}
+
+    def build_path(category):
+        if not category.path:
+            parent = categories.get(category.parent_id)
+            parent_path = build_path(parent) if parent else ""
+            category.path = f"{parent_path}{category.pk}/"
+            category.depth = category.path.count("/") - 1
+        return category.path
+
+    for category in categories.values():
+        build_path(category)
+    GoodCategory.objects.bulk_update(categories.values(), ["path", "depth"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0009_alter_basketitem_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="goodcategory",
+            name="depth",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="goodcategory",
+            name="path",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE shop_good_fts USING fts5("
+    "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO shop_good_fts (rowid, name, description) "
+    "SELECT id, name, description FROM shop_good",
+]
+SQLITE_BACKWARD = ["DROP TABLE IF EXISTS shop_good_fts"]
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX shop_good_search_idx ON shop_good USING GIN (("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')))",
+]
+POSTGRES_BACKWARD = ["DROP INDEX IF EXISTS shop_good_search_idx"]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0010_goodcategory_path"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run_for_vendor({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
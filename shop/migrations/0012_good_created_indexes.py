@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-17 20:40
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0011_good_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="good",
+            name="created",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(
+                fields=["category", "price"], name="good_category_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(
+                fields=["category", "-created"], name="good_category_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(
+                fields=["seller", "price"], name="good_seller_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(fields=["price"], name="good_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(fields=["-created"], name="good_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="good",
+            index=models.Index(fields=["name"], name="good_name_idx"),
+        ),
+    ]
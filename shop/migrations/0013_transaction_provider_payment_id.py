@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-17 20:43
+
+import json
+
+from django.db import migrations, models
+
+
+def fill_provider_payment_id(apps, schema_editor):
+    Transaction = apps.get_model("shop", "Transaction")
+    batch = []
+    for transaction in Transaction.objects.filter(
+        provider_payment_id__isnull=True
+    ).iterator():
+        data = transaction.provider_data
+        # payment.json() сохранялся строкой, поэтому provider_data бывает и str, и dict
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                continue
+        if not isinstance(data, dict) or not data.get("id"):
+            continue
+        transaction.provider_payment_id = data["id"]
+        batch.append(transaction)
+        if len(batch) >= 500:
+            Transaction.objects.bulk_update(batch, ["provider_payment_id"])
+            batch = []
+    Transaction.objects.bulk_update(batch, ["provider_payment_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0012_good_created_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="provider_payment_id",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="provider_data",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_provider_payment_id, migrations.RunPython.noop),
+    ]
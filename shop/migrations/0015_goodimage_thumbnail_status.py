@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+def mark_existing_thumbnails_ready(apps, schema_editor):
+    GoodImage = apps.get_model("shop", "GoodImage")
+    GoodImage.objects.exclude(thumbnail__isnull=True).exclude(thumbnail="").update(
+        thumbnail_status="ready"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0014_webhookevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="goodimage",
+            name="thumbnail_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В очереди"),
+                    ("ready", "Готово"),
+                    ("failed", "Ошибка"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(mark_existing_thumbnails_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-17 20:46
+
+import django.db.models.deletion
+import storages.backends.s3
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0015_goodimage_thumbnail_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GoodImageRendition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("width", models.PositiveIntegerField()),
+                ("height", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=10)),
+                (
+                    "file",
+                    models.ImageField(
+                        storage=storages.backends.s3.S3Storage(),
+                        upload_to="goods/renditions/",
+                    ),
+                ),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="renditions",
+                        to="shop.goodimage",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("image", "width", "format"),
+                        name="unique_image_rendition",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from storages.backends.s3boto3 import S3Boto3Storage
 
 from PIL import Image
@@ -19,10 +22,62 @@ class GoodCategory(models.Model):
         related_name='children',
         on_delete=models.CASCADE
     )
+    # Материализованный путь: id всех предков и самой категории, например '1/5/12/'
+    path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
 
+    def clean(self):
+        if self.parent_id and self.pk and self.parent.is_descendant_of(self):
+            raise ValidationError({'parent': 'Категория не может быть вложена сама в себя.'})
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        parent_path = self.parent.path if self.parent_id else ''
+        new_path = f'{parent_path}{self.pk}/'
+        if new_path == self.path:
+            return
+
+        old_path = self.path
+        new_depth = new_path.count('/') - 1
+        if old_path:
+            # Категорию перенесли — переписываем путь всего поддерева одним UPDATE
+            GoodCategory.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - self.depth),
+            )
+        GoodCategory.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        self.path = new_path
+        self.depth = new_depth
+
+    @property
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.split('/') if pk][:-1]
+
+    def is_descendant_of(self, other):
+        return self.path.startswith(other.path)
+
+    def get_ancestors(self):
+        """
+        Предки от корня к родителю (хлебные крошки) — один запрос.
+        """
+        return GoodCategory.objects.filter(pk__in=self.ancestor_ids).order_by('depth')
+
+    def get_descendants(self, include_self=True):
+        queryset = GoodCategory.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+    def get_goods(self):
+        """
+        Товары категории и всех её подкатегорий — один запрос.
+        """
+        return Good.objects.filter(category__path__startswith=self.path)
+
 
 class Good(models.Model):
     name = models.CharField(max_length=255)
@@ -36,32 +91,69 @@ class Good(models.Model):
         null=True,
         blank=True
     )
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Под фильтры и сортировки каталога (shop/filters.py)
+        indexes = [
+            models.Index(fields=['category', 'price'], name='good_category_price_idx'),
+            models.Index(fields=['category', '-created'], name='good_category_created_idx'),
+            models.Index(fields=['seller', 'price'], name='good_seller_price_idx'),
+            models.Index(fields=['price'], name='good_price_idx'),
+            models.Index(fields=['-created'], name='good_created_idx'),
+            models.Index(fields=['name'], name='good_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class GoodImage(models.Model):
+    THUMBNAIL_STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('ready', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
     good = models.ForeignKey(Good, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='goods/', storage=S3Boto3Storage())
     thumbnail = models.ImageField(upload_to='goods/thumbs/', storage=S3Boto3Storage(), blank=True, null=True)
+    # Превью и рендишены строит фоновая задача shop.tasks.generate_thumbnail
+    thumbnail_status = models.CharField(max_length=10, choices=THUMBNAIL_STATUS_CHOICES, default='pending')
+
+    def build_thumbnail(self):
+        img = Image.open(self.image)
+        img = img.convert("RGB")
+        img.thumbnail((300, 300))  # размер превью
+
+        thumb_io = BytesIO()
+        img.save(thumb_io, format='JPEG', quality=80)
+
+        thumb_name = f"thumb_{self.image.name.split('/')[-1]}"
+        # Превью от прошлой (неудачной) попытки иначе осталось бы в хранилище сиротой
+        previous = self.thumbnail.name
+        self.thumbnail.save(thumb_name, ContentFile(thumb_io.getvalue()), save=False)
+        if previous:
+            self.thumbnail.storage.delete(previous)
+
+
+class GoodImageRendition(models.Model):
+    """
+    Уменьшенная копия GoodImage заданной ширины и формата (см. shop/renditions.py).
+    """
+    image = models.ForeignKey(GoodImage, on_delete=models.CASCADE, related_name='renditions')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    file = models.ImageField(upload_to='goods/renditions/', storage=S3Boto3Storage())
 
-    def save(self, *args, **kwargs):
-        if self.image and not self.thumbnail:
-            try:
-                img = Image.open(self.image)
-                img = img.convert("RGB")
-                img.thumbnail((300, 300))  # размер превью
-
-                thumb_io = BytesIO()
-                img.save(thumb_io, format='JPEG', quality=80)
-
-                thumb_name = f"thumb_{self.image.name.split('/')[-1]}"
-                self.thumbnail.save(thumb_name, ContentFile(thumb_io.getvalue()), save=False)
-            except Exception as e:
-                print(f"Ошибка создания превью: {e}")
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'width', 'format'], name='unique_image_rendition')
+        ]
 
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return f"{self.image_id} {self.width}w {self.format}"
 
 
 class PaymentMethod(models.Model):
@@ -103,6 +195,58 @@ class Recipient(models.Model):
         return f"{self.last_name} {self.first_name}"
 
 
+class BasketItemQuerySet(models.QuerySet):
+
+    def add(self, user, counts):
+        """
+        Добавляет товары в корзину одним INSERT ... ON CONFLICT DO UPDATE:
+        если товар уже лежит в корзине, количество увеличивается прямо в базе,
+        поэтому параллельные запросы не теряют обновления.
+
+        counts — {good_id: count}. Возвращает {good_id: BasketItem} с итоговым количеством;
+        у каждого объекта атрибут created — True, если строки в корзине раньше не было.
+        """
+        if not counts:
+            return {}
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        values = ', '.join(['(%s, %s, %s)'] * len(counts))
+        params = []
+        for good_id, count in counts.items():
+            params += [user.pk, good_id, count]
+
+        if connection.vendor == 'postgresql':
+            # xmax = 0 только у строк, вставленных этим же оператором
+            created_column = '(xmax = 0)'
+        else:
+            # В SQLite признака вставки нет — сравниваем с чтением в той же транзакции
+            # (транзакции пишущие, IMMEDIATE, так что между чтением и INSERT строк не появится)
+            created_column = 'NULL'
+        sql = (
+            f'INSERT INTO {table} ({quote("user_id")}, {quote("good_id")}, {quote("count")}) '
+            f'VALUES {values} '
+            f'ON CONFLICT ({quote("user_id")}, {quote("good_id")}) '
+            f'DO UPDATE SET {quote("count")} = {table}.{quote("count")} + excluded.{quote("count")} '
+            f'RETURNING {quote("id")}, {quote("good_id")}, {quote("count")}, {created_column}'
+        )
+        with transaction.atomic(savepoint=False):
+            existing = None
+            if connection.vendor != 'postgresql':
+                existing = set(
+                    self.filter(user=user, good_id__in=list(counts)).values_list('good_id', flat=True)
+                )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+
+        items = {}
+        for pk, good_id, count, created in rows:
+            item = self.model(pk=pk, user=user, good_id=good_id, count=count)
+            item.created = bool(created) if existing is None else good_id not in existing
+            items[good_id] = item
+        return items
+
+
 class BasketItem(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -112,6 +256,8 @@ class BasketItem(models.Model):
     good = models.ForeignKey('Good', on_delete=models.CASCADE, related_name='basket_items')
     count = models.PositiveIntegerField()
 
+    objects = BasketItemQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'good'], name='unique_user_good')
@@ -169,8 +315,40 @@ class Transaction(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     provider_data = models.JSONField(null=True, blank=True)  # ⬅️ обязательно
+    # id платежа у провайдера — по нему вебхук находит транзакцию
+    provider_payment_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Transaction #{self.id} - {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Входящие уведомления платёжного провайдера (append-only inbox).
+    Вебхук только записывает событие, статусы меняет фоновая задача.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSED', 'Processed'),
+        ('FAILED', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=32)
+    # Тип события + id платежа: повторная доставка того же события не создаёт новую запись
+    event_key = models.CharField(max_length=255)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_key'], name='unique_webhook_event')
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_key} - {self.status}"
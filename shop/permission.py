@@ -1,11 +1,13 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
+from users import roles
+
 
 class IsSellerAndOwnerOrReadOnly(BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in SAFE_METHODS:
-            return obj.seller == request.user
-        return obj.seller == request.user
+            return obj.seller_id == request.user.pk
+        return obj.seller_id == request.user.pk
 
 
 class IsAdminOnly(BasePermission):
@@ -21,15 +23,15 @@ class IsSellerOrAdmin(BasePermission):
     Разрешает доступ продавцам или админам.
     """
     def has_permission(self, request, view):
-        return request.user and (request.user.is_staff or request.user.groups.filter(name='seller').exists())
+        return request.user and (request.user.is_staff or roles.is_seller(request.user))
 
 
 class IsOwnerOrAdmin(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user.is_staff or obj.user == request.user
+        return request.user.is_staff or obj.user_id == request.user.pk
 
 class IsSellerOnly(BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and (
-            request.user.role == 'seller' or request.user.is_staff
+            request.user.is_staff or roles.is_seller(request.user)
         )
@@ -0,0 +1,79 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+# Параметры кодирования для каждого формата
+FORMAT_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+
+def available_formats():
+    """
+    Форматы из IMAGE_RENDITION_FORMATS, которые умеет писать установленный Pillow
+    (AVIF есть не во всех сборках).
+    """
+    Image.init()
+    return [
+        fmt for fmt in settings.IMAGE_RENDITION_FORMATS
+        if fmt in FORMAT_OPTIONS and FORMAT_OPTIONS[fmt]['format'] in Image.SAVE
+    ]
+
+
+def target_widths(source_width):
+    # Не увеличиваем картинку: ширины больше оригинала схлопываются в оригинал
+    return sorted({min(width, source_width) for width in settings.IMAGE_RENDITION_WIDTHS})
+
+
+def build_renditions(good_image):
+    """
+    Строит набор рендишенов для GoodImage и заменяет ими старые.
+    Оригинал декодируется один раз, ширины обходятся от большей к меньшей,
+    чтобы каждый следующий ресайз шёл из уже уменьшенной копии.
+    """
+    from .models import GoodImageRendition
+
+    formats = available_formats()
+    renditions = []
+    stem = good_image.image.name.split('/')[-1].rsplit('.', 1)[0]
+
+    with Image.open(good_image.image) as source:
+        # Для JPEG декодер сразу отдаёт уменьшенную картинку, если она не меньше нужной
+        max_width = max(settings.IMAGE_RENDITION_WIDTHS)
+        source.draft('RGB', (max_width, max_width))
+        current = ImageOps.exif_transpose(source)
+        current = current.convert('RGBA' if 'A' in current.getbands() else 'RGB')
+        widths = target_widths(current.width)
+
+        for width in reversed(widths):
+            height = max(1, round(current.height * width / current.width))
+            if width != current.width:
+                current = current.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                options = dict(FORMAT_OPTIONS[fmt])
+                encoded = current.convert('RGB') if fmt == 'jpeg' else current
+                buffer = BytesIO()
+                encoded.save(buffer, **options)
+
+                rendition = GoodImageRendition(image=good_image, width=width, height=height, format=fmt)
+                rendition.file.save(f'{stem}_{width}.{fmt}', ContentFile(buffer.getvalue()), save=False)
+                renditions.append(rendition)
+
+    # Удаление строк не трогает файлы — старые рендишены убираем из хранилища сами,
+    # но только после коммита, чтобы при откате строки не ссылались на пустоту
+    old = list(good_image.renditions.all())
+    with transaction.atomic():
+        GoodImageRendition.objects.filter(pk__in=[rendition.pk for rendition in old]).delete()
+        created = GoodImageRendition.objects.bulk_create(renditions)
+    transaction.on_commit(lambda: delete_rendition_files(old))
+    return created
+
+
+def delete_rendition_files(renditions):
+    for rendition in renditions:
+        rendition.file.delete(save=False)
@@ -0,0 +1,132 @@
+import re
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return [token.lower() for token in TOKEN_RE.findall(query)]
+
+
+class BaseSearchBackend(ABC):
+    """
+    Поисковый бэкенд по товарам. search() возвращает id товаров,
+    отсортированные по релевантности.
+    """
+
+    @abstractmethod
+    def search(self, query, limit):
+        pass
+
+    def update(self, good):
+        """Обновить товар в индексе (вызывается после сохранения)."""
+
+    def remove(self, good_id):
+        """Убрать товар из индекса (вызывается после удаления)."""
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5. Таблица shop_good_fts создаётся миграцией 0011.
+    """
+    table = 'shop_good_fts'
+
+    def build_match(self, tokens):
+        # Каждое слово ищем по префиксу: "смарт"* AND "sams"*
+        return ' AND '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, 10.0, 1.0), rowid LIMIT %s',
+                [self.build_match(tokens), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def update(self, good):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [good.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [good.pk, good.name, good.description],
+            )
+
+    def remove(self, good_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [good_id])
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL tsvector. GIN-индекс по тому же выражению создаётся миграцией 0011
+    и обновляется самой базой, поэтому update/remove ничего не делают.
+    """
+    config = 'simple'
+    document = (
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+    )
+
+    def build_query(self, tokens):
+        # Префиксный поиск: смарт:* & sams:*
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        tsquery = f"to_tsquery('{self.config}', %s)"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM shop_good WHERE ({self.document}) @@ {tsquery} '
+                f'ORDER BY ts_rank({self.document}, {tsquery}) DESC, id LIMIT %s',
+                [self.build_query(tokens), self.build_query(tokens), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """
+    Запасной вариант для баз без полнотекстового индекса: каждое слово ищется через
+    icontains в названии или описании, совпадения в названии выше. Полный просмотр таблицы.
+    """
+
+    def search(self, query, limit):
+        from .models import Good
+
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        matches = Q()
+        in_name = Q()
+        for token in tokens:
+            matches &= Q(name__icontains=token) | Q(description__icontains=token)
+            in_name &= Q(name__icontains=token)
+        rank = Case(When(in_name, then=Value(0)), default=Value(1), output_field=IntegerField())
+        return list(
+            Good.objects.filter(matches).annotate(rank=rank).order_by('rank', 'pk').values_list('pk', flat=True)[:limit]
+        )
+
+
+DEFAULT_BACKENDS = {
+    'sqlite': 'shop.search.SQLiteSearchBackend',
+    'postgresql': 'shop.search.PostgresSearchBackend',
+}
+
+_backends = {}
+
+
+def get_backend():
+    path = settings.SEARCH_BACKEND or DEFAULT_BACKENDS.get(connection.vendor, 'shop.search.LikeSearchBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
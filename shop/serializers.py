@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from .models import GoodCategory, Good, GoodImage, PaymentMethod, DeliveryMethod, Recipient, BasketItem, Checkout, \
     CheckoutItem, Transaction
+from . import uploads
+from .media import file_url
+from django.conf import settings
+from onlineStores.metrics import TimedListSerializer, TimedSerializerMixin
 import json
 from rest_framework import serializers
 
@@ -15,33 +19,71 @@ class GoodCategorySerializer(serializers.ModelSerializer):
         model = GoodCategory
         fields = ['id', 'title', 'description', 'parentId']
 
+    def validate_parentId(self, parent):
+        if parent and self.instance and parent.is_descendant_of(self.instance):
+            raise serializers.ValidationError('Категория не может быть вложена сама в себя.')
+        return parent
 
-class GoodImageSerializer(serializers.ModelSerializer):
-    image = serializers.SerializerMethodField()
-    thumbnail = serializers.SerializerMethodField()
 
-    def get_image(self, obj):
-        request = self.context.get('request')
-        if obj.image and hasattr(obj.image, 'url'):
-            return request.build_absolute_uri(obj.image.url) if request else obj.image.url
-        return None
+class CachedFileField(serializers.ImageField):
+    """
+    ImageField, который отдаёт URL через shop.media.file_url (кэш в памяти / CDN).
+    """
+
+    def to_representation(self, value):
+        return file_url(value, self.context.get('request'))
 
-    def get_thumbnail(self, obj):
-        request = self.context.get('request')
-        if obj.thumbnail and hasattr(obj.thumbnail, 'url'):
-            return request.build_absolute_uri(obj.thumbnail.url) if request else obj.thumbnail.url
-        return None
 
-    class Meta:
-        model = GoodImage
-        fields = ['id', 'image', 'thumbnail']
 class GoodImageSerializer(serializers.ModelSerializer):
+    image = CachedFileField(read_only=True)
+    thumbnail = CachedFileField(read_only=True)
+    srcset = serializers.SerializerMethodField()
+
+    def get_srcset(self, obj):
+        """
+        {"webp": "https://.../a_320.webp 320w, https://.../a_640.webp 640w", ...}
+        """
+        request = self.context.get('request')
+        srcset = {}
+        for rendition in sorted(obj.renditions.all(), key=lambda r: r.width):
+            url = file_url(rendition.file, request)
+            srcset.setdefault(rendition.format, []).append(f'{url} {rendition.width}w')
+        return {fmt: ', '.join(candidates) for fmt, candidates in srcset.items()}
+
     class Meta:
         model = GoodImage
-        fields = ['id', 'image', 'thumbnail']
-
-
-class GoodSerializer(serializers.ModelSerializer):
+        fields = ['id', 'image', 'thumbnail', 'thumbnail_status', 'srcset']
+
+
+class GoodImageUploadRequestSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    contentType = serializers.ChoiceField(choices=settings.IMAGE_DIRECT_UPLOAD_CONTENT_TYPES)
+    size = serializers.IntegerField(min_value=1, max_value=settings.IMAGE_DIRECT_UPLOAD_MAX_SIZE)
+
+
+class GoodImageFinalizeSerializer(serializers.Serializer):
+    """
+    Ключи загруженных напрямую в S3 файлов. Товар передаётся в context['good'].
+    """
+    keys = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False, max_length=50)
+
+    def validate_keys(self, keys):
+        keys = list(dict.fromkeys(keys))
+        prefix = uploads.direct_upload_prefix(self.context['good'])
+        # Регистрировать можно только ключи, выданные под этот товар
+        foreign = [key for key in keys if not key.startswith(prefix) or '..' in key]
+        if foreign:
+            raise serializers.ValidationError(f"Ключи не относятся к этому товару: {', '.join(foreign)}")
+        registered = set(GoodImage.objects.filter(image__in=keys).values_list('image', flat=True))
+        if registered:
+            raise serializers.ValidationError(f"Файлы уже зарегистрированы: {', '.join(sorted(registered))}")
+        missing = uploads.missing_uploads(keys)
+        if missing:
+            raise serializers.ValidationError(f"Файлы не найдены в хранилище: {', '.join(missing)}")
+        return keys
+
+
+class GoodSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     categoryId = serializers.PrimaryKeyRelatedField(
         source='category', queryset=GoodCategory.objects.all()
     )
@@ -61,10 +103,32 @@ class GoodSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'price',
             'categoryId', 'sellerId', 'images'
         ]
+        list_serializer_class = TimedListSerializer
+
+
+class GoodListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Компактное представление для сеток каталога: без описания и только с превью первой картинки.
+    """
+    thumbnail = serializers.SerializerMethodField()
 
+    def get_thumbnail(self, obj):
+        images = obj.images.all()
+        if not images:
+            return None
+        primary = min(images, key=lambda image: image.pk)
+        # Пока превью не построено, отдаём оригинал
+        return file_url(primary.thumbnail or primary.image, self.context.get('request'))
+
+    class Meta:
+        model = Good
+        fields = ['id', 'name', 'price', 'thumbnail']
+        list_serializer_class = TimedListSerializer
 
 
 class PaymentMethodSerializer(serializers.ModelSerializer):
+    logo = CachedFileField(required=False, allow_null=True)
+
     class Meta:
         model = PaymentMethod
         fields = ['id', 'title', 'description', 'logo']
@@ -104,6 +168,31 @@ class BasketItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'goodId', 'good', 'count']
 
 
+class BasketItemAddSerializer(serializers.Serializer):
+    goodId = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1)
+
+
+class BasketItemBulkAddSerializer(serializers.ListSerializer):
+    child = BasketItemAddSerializer()
+
+    # Все позиции уходят одним INSERT, так что список ограничен, чтобы не упереться в лимит параметров
+    MAX_ITEMS = 100
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', self.MAX_ITEMS)
+        super().__init__(*args, **kwargs)
+
+    def validate(self, attrs):
+        # Одним запросом проверяем, что все товары существуют
+        good_ids = {item['goodId'] for item in attrs}
+        found = set(Good.objects.filter(pk__in=good_ids).values_list('pk', flat=True))
+        missing = good_ids - found
+        if missing:
+            raise serializers.ValidationError(f"Товары не найдены: {', '.join(map(str, sorted(missing)))}")
+        return attrs
+
+
 class CheckoutItemSerializer(serializers.ModelSerializer):
     goodId = serializers.PrimaryKeyRelatedField(source='good', read_only=True)
 
@@ -126,7 +215,7 @@ class CheckoutSerializer(serializers.ModelSerializer):
             'paymentMethodId', 'deliveryMethodId',
             'payment_total', 'created', 'items', 'status'
         ]
-        read_only_fields = ['user', 'created', 'is_paid', 'status']
+        read_only_fields = ['user', 'payment_total', 'created', 'is_paid', 'status']
 
 class TransactionSerializer(serializers.ModelSerializer):
     checkoutId = serializers.PrimaryKeyRelatedField(source='checkout', queryset=Checkout.objects.all())
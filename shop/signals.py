@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import GoodCategory, Good, GoodImage
+from . import cache as shop_cache
+from .search import get_backend as get_search_backend
+from .tasks import queue_thumbnails
+
+
+@receiver([post_save, post_delete], sender=Good)
+@receiver([post_save, post_delete], sender=GoodImage)
+def invalidate_catalog_cache(sender, **kwargs):
+    shop_cache.bump_version(shop_cache.CATALOG)
+
+
+@receiver(post_save, sender=Good)
+def update_search_index(sender, instance, **kwargs):
+    get_search_backend().update(instance)
+
+
+@receiver(post_delete, sender=Good)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=GoodCategory)
+def invalidate_category_cache(sender, **kwargs):
+    shop_cache.bump_version(shop_cache.CATEGORIES)
+    # Перенос категории переписывает path поддерева, а от него зависят
+    # закэшированные страницы каталога с include_descendants
+    shop_cache.bump_version(shop_cache.CATALOG)
+
+
+@receiver(post_save, sender=GoodImage)
+def queue_thumbnail(sender, instance, created, **kwargs):
+    if created and not instance.thumbnail and instance.thumbnail_status == 'pending':
+        queue_thumbnails([instance])
@@ -0,0 +1,200 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .models import GoodImage, Transaction, WebhookEvent
+from .renditions import build_renditions
+
+WEBHOOK_MAX_ATTEMPTS = 5
+# Повторы обработки события: 30 с, 1 мин, 2 мин... но не реже раза в полчаса
+WEBHOOK_RETRY_DELAY = 30
+WEBHOOK_MAX_RETRY_DELAY = 30 * 60
+# Сколько ждать, пока закоммитится Transaction, прежде чем считать попытки
+WEBHOOK_TRANSACTION_WAIT = timedelta(hours=1)
+THUMBNAIL_MAX_RETRIES = 3
+# Куда клиенты грузят картинки по presigned POST (shop/uploads.py), по папке на товар
+DIRECT_UPLOAD_ROOT = 'goods/uploads/'
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionNotFound(LookupError):
+    pass
+
+
+def webhook_retry_countdown(retries):
+    return min(WEBHOOK_RETRY_DELAY * 2 ** retries, WEBHOOK_MAX_RETRY_DELAY)
+
+
+def apply_yookassa_event(event):
+    """
+    Переносит статус платежа из события ЮKassa на транзакцию и заказ.
+    """
+    object_data = event.payload.get('object', {})
+    payment_id = object_data.get('id')
+    payment_status = object_data.get('status')
+
+    transaction = Transaction.objects.select_for_update().select_related('checkout') \
+        .filter(provider_payment_id=payment_id).first()
+    if not transaction:
+        # Вебхук мог прийти раньше, чем закоммитилась транзакция, — попробуем позже
+        raise TransactionNotFound(f'Transaction для платежа {payment_id} не найдена')
+
+    if transaction.status == 'SUCCESS':
+        # Оплата уже проведена, запоздавшие события статус не откатывают
+        return
+
+    transaction.status = 'SUCCESS' if payment_status == 'succeeded' else 'ERROR'
+    transaction.provider_data = object_data
+    transaction.save(update_fields=['status', 'provider_data', 'updated'])
+
+    if payment_status == 'succeeded':
+        checkout = transaction.checkout
+        checkout.is_paid = True
+        checkout.status = 'PAID'
+        checkout.save(update_fields=['is_paid', 'status'])
+
+
+# Число повторов ограничивает event.attempts, а не Celery: ожидание Transaction попыткой не считается
+@shared_task(bind=True, max_retries=None)
+def process_webhook_event(self, event_id):
+    """
+    Обрабатывает событие из inbox. Повторный вызов для уже обработанного события ничего не делает.
+    """
+    error = None
+    with db_transaction.atomic():
+        event = WebhookEvent.objects.select_for_update().get(pk=event_id)
+        if event.status != 'PENDING':
+            return event.status
+
+        try:
+            with db_transaction.atomic():
+                apply_yookassa_event(event)
+        except Exception as exc:
+            error = exc
+            event.error = str(exc)
+            waiting = isinstance(exc, TransactionNotFound) and \
+                timezone.now() - event.received < WEBHOOK_TRANSACTION_WAIT
+            if not waiting:
+                event.attempts += 1
+                if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                    event.status = 'FAILED'
+                    logger.error('Событие вебхука %s не обработано за %s попыток: %s', event.pk, event.attempts, exc)
+        else:
+            event.attempts += 1
+            event.status = 'PROCESSED'
+            event.processed = timezone.now()
+            event.error = ''
+        event.save(update_fields=['status', 'attempts', 'error', 'processed'])
+
+    if event.status == 'PENDING':
+        if self.request.is_eager or self.request.called_directly:
+            # Без брокера повтор выполнился бы сразу же, без паузы, —
+            # событие останется PENDING до requeue_pending_webhook_events или повторной доставки
+            return event.status
+        raise self.retry(exc=error, countdown=webhook_retry_countdown(self.request.retries))
+    return event.status
+
+
+def enqueue_webhook_event(event_id):
+    """
+    Ставит обработку события в очередь. Если брокер недоступен, событие уже лежит в inbox
+    как PENDING и его подберёт requeue_pending_webhook_events.
+    """
+    try:
+        process_webhook_event.delay(event_id)
+    except Exception:
+        logger.exception('Не удалось поставить в очередь событие вебхука %s', event_id)
+
+
+@shared_task
+def requeue_pending_webhook_events(older_than_seconds=5 * 60):
+    """
+    Страховка на случай, если событие записали, а задачу в брокер не поставили.
+    Запускается по расписанию (CELERY_BEAT_SCHEDULE).
+    """
+    threshold = timezone.now() - timedelta(seconds=older_than_seconds)
+    event_ids = list(
+        WebhookEvent.objects.filter(status='PENDING', received__lt=threshold).values_list('pk', flat=True)
+    )
+    for event_id in event_ids:
+        enqueue_webhook_event(event_id)
+    return len(event_ids)
+
+
+@shared_task(bind=True, max_retries=THUMBNAIL_MAX_RETRIES)
+def generate_thumbnail(self, image_id):
+    """
+    Строит превью и рендишены (shop/renditions.py) для загруженной картинки.
+    После исчерпания ретраев помечает её как failed.
+    """
+    image = GoodImage.objects.filter(pk=image_id).first()
+    if image is None or image.thumbnail_status == 'ready':
+        return None
+
+    try:
+        image.build_thumbnail()
+        # Имя превью сохраняем сразу: если упадут рендишены, ретрай удалит этот файл
+        image.save(update_fields=['thumbnail'])
+        build_renditions(image)
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            logger.warning('Не удалось построить превью картинки %s: %s', image.pk, exc)
+            image.thumbnail_status = 'failed'
+            image.save(update_fields=['thumbnail_status'])
+            return image.thumbnail_status
+        raise self.retry(exc=exc, countdown=10 * 2 ** self.request.retries)
+
+    image.thumbnail_status = 'ready'
+    image.save(update_fields=['thumbnail_status'])
+    return image.thumbnail_status
+
+
+def queue_thumbnails(images):
+    """
+    Ставит построение превью в очередь после коммита текущей транзакции.
+    """
+    for image in images:
+        db_transaction.on_commit(lambda image_id=image.pk: generate_thumbnail.delay(image_id))
+
+
+def queue_pending_thumbnails(statuses=('pending',)):
+    """
+    Ставит в очередь картинки с заданными статусами превью. Нужна для картинок,
+    загруженных до фоновой обработки: миграция пометила их pending, но задач для них нет.
+    """
+    image_ids = list(GoodImage.objects.filter(thumbnail_status__in=statuses).values_list('pk', flat=True))
+    for image_id in image_ids:
+        generate_thumbnail.delay(image_id)
+    return len(image_ids)
+
+
+@shared_task
+def purge_unfinalized_uploads():
+    """
+    Удаляет файлы прямой загрузки, для которых так и не вызвали finalize: клиент получил
+    presigned POST, положил файл в бакет, но картинку не зарегистрировал.
+    Файл удаляется, если он старше IMAGE_DIRECT_UPLOAD_CLEANUP_AGE и на него нет GoodImage.
+    Запускается по расписанию (CELERY_BEAT_SCHEDULE).
+    """
+    storage = GoodImage._meta.get_field('image').storage
+    threshold = timezone.now() - timedelta(seconds=settings.IMAGE_DIRECT_UPLOAD_CLEANUP_AGE)
+    removed = 0
+    try:
+        folders, _ = storage.listdir(DIRECT_UPLOAD_ROOT)
+    except FileNotFoundError:
+        return removed
+    for folder in folders:
+        prefix = f'{DIRECT_UPLOAD_ROOT}{folder}/'
+        names = [prefix + filename for filename in storage.listdir(prefix)[1]]
+        registered = set(GoodImage.objects.filter(image__in=names).values_list('image', flat=True))
+        for name in names:
+            if name in registered or storage.get_modified_time(name) >= threshold:
+                continue
+            storage.delete(name)
+            removed += 1
+    return removed
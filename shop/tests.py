@@ -1,3 +1,1269 @@
-from django.test import TestCase
+import base64
+import importlib
+import importlib.util
+import json
+import logging
+import sys
+import tempfile
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import InMemoryStorage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from users.claims import refresh_token_for
+from users.models import User
+from .models import GoodCategory, Good, GoodImage, GoodImageRendition, BasketItem, Checkout, CheckoutItem, Recipient, PaymentMethod, \
+    DeliveryMethod, Transaction, WebhookEvent
+from .tasks import process_webhook_event, requeue_pending_webhook_events, webhook_retry_countdown, \
+    WEBHOOK_MAX_ATTEMPTS, WEBHOOK_MAX_RETRY_DELAY, WEBHOOK_TRANSACTION_WAIT, generate_thumbnail, purge_unfinalized_uploads
+from .renditions import available_formats, build_renditions
+from .media import clear_url_cache, storage_url
+from .search import BaseSearchBackend
+from .serializers import BasketItemBulkAddSerializer, GoodListSerializer
+from .uploads import storage_key
+from onlineStores.logs import JsonFormatter, QueueStreamHandler, RequestIdFilter, request_id_var
+from onlineStores.metrics import RequestMetrics, registry as metrics_registry
+
+
+class InMemoryImageStorageMixin:
+    """
+    Подменяет S3-хранилище картинок на InMemoryStorage, чтобы тесты не ходили в сеть.
+    """
+    storage_fields = [
+        (Good, 'image'),
+        (GoodImage, 'image'),
+        (GoodImage, 'thumbnail'),
+        (GoodImageRendition, 'file'),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._original_storages = []
+        storage = InMemoryStorage(base_url='http://media.test/')
+        for model, field_name in cls.storage_fields:
+            field = model._meta.get_field(field_name)
+            cls._original_storages.append((field, field.storage))
+            field.storage = storage
+
+    @classmethod
+    def tearDownClass(cls):
+        for field, storage in cls._original_storages:
+            field.storage = storage
+        super().tearDownClass()
+
+
+def make_image_file(name='photo.png', size=(800, 600), color=(200, 30, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def create_goods(category, seller, count, images_per_good=2):
+    goods = []
+    for i in range(count):
+        good = Good.objects.create(
+            name=f'Товар {i}',
+            description='Описание',
+            price=Decimal('100.00') + i,
+            category=category,
+            seller=seller,
+        )
+        for j in range(images_per_good):
+            GoodImage.objects.create(
+                good=good,
+                image=f'goods/{good.pk}_{j}.jpg',
+                thumbnail=f'goods/thumbs/thumb_{good.pk}_{j}.jpg',
+            )
+        goods.append(good)
+    return goods
+
+
+class GoodQueryCountTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.category = GoodCategory.objects.create(title='Категория')
+
+    def test_catalog_page_query_count_does_not_depend_on_goods(self):
+        create_goods(self.category, self.seller, 2)
+        # COUNT для пагинации + товары + картинки (список отдаёт только превью)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/catalog/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 2)
+
+        create_goods(self.category, self.seller, 8)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/catalog/')
+        self.assertEqual(len(response.json()['items']), 10)
+        self.assertEqual(set(response.json()['items'][0]), {'id', 'name', 'price', 'thumbnail'})
+
+    def test_detail_query_count_with_renditions(self):
+        good = create_goods(self.category, self.seller, 1, images_per_good=5)[0]
+        for image in GoodImage.objects.all():
+            GoodImageRendition.objects.bulk_create(
+                GoodImageRendition(image=image, width=width, height=width, format='webp', file=f'r/{image.pk}_{width}.webp')
+                for width in (320, 640)
+            )
+        # Товар с категорией и продавцом + картинки + рендишены
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/v1/catalog/{good.pk}/')
+        self.assertEqual(len(response.json()['images']), 5)
+        srcset = response.json()['images'][0]['srcset']
+        self.assertEqual(list(srcset), ['webp'])
+        self.assertTrue(srcset['webp'].endswith('640w'))
+
+    def test_seller_goods_page_query_count_does_not_depend_on_goods(self):
+        create_goods(self.category, self.seller, 10)
+        self.client.force_authenticate(self.seller)
+        # Продавцу список отдаётся полным сериализатором: COUNT + товары + картинки + рендишены
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/goods/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 10)
+        self.assertTrue({'description', 'categoryId', 'sellerId', 'images'} <= set(response.json()['items'][0]))
+
+    def test_seller_jwt_does_not_load_user(self):
+        create_goods(self.category, self.seller, 10)
+        token = refresh_token_for(self.seller).access_token
+        # Роль из claims токена: те же запросы, что и с force_authenticate, без SELECT пользователя
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/goods/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 10)
+
+
+class CursorPaginationTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.category = GoodCategory.objects.create(title='Категория')
+        self.goods = create_goods(self.category, self.seller, 15, images_per_good=1)
+
+    def test_cursor_pages_cover_all_goods_without_count(self):
+        # Без COUNT(*): только товары и картинки
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/catalog/', {'pagination': 'cursor'})
+        data = response.json()
+        self.assertNotIn('totalCount', data)
+        self.assertIsNone(data['prevPage'])
+        ids = [item['id'] for item in data['items']]
+
+        response = self.client.get(data['nextPage'])
+        data = response.json()
+        ids += [item['id'] for item in data['items']]
+        self.assertIsNone(data['nextPage'])
+        self.assertIsNotNone(data['prevPage'])
+        self.assertEqual(ids, sorted((good.pk for good in self.goods), reverse=True))
+
+    def test_page_and_cursor_modes_share_default_order(self):
+        expected = sorted((good.pk for good in self.goods), reverse=True)[:10]
+        self.client.force_authenticate(self.seller)
+        urls = ['/api/v1/catalog/', '/api/v1/goods/', f'/api/v1/good-categories/{self.category.pk}/goods/']
+        for url in urls:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', UnorderedObjectListWarning)
+                page = self.client.get(url).json()['items']
+            self.assertEqual([item['id'] for item in page], expected, url)
+        cursor = self.client.get('/api/v1/catalog/', {'pagination': 'cursor'}).json()['items']
+        self.assertEqual([item['id'] for item in cursor], expected)
+
+    def test_total_count_is_cached(self):
+        self.client.force_authenticate(self.seller)
+        response = self.client.get('/api/v1/goods/', {'pagination': 'cursor', 'withTotal': 'true'})
+        self.assertEqual(response.json()['totalCount'], 15)
+        # COUNT берётся из кэша: только товары, картинки и рендишены
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/goods/', {'pagination': 'cursor', 'withTotal': 'true'})
+        self.assertEqual(response.json()['totalCount'], 15)
+
+    def test_cursor_by_sort_field_does_not_load_deferred_columns(self):
+        params = {'pagination': 'cursor', 'ordering': 'created'}
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/v1/catalog/', params).json()
+        with self.assertNumQueries(2):
+            data = self.client.get(data['nextPage']).json()
+        self.assertEqual(len(data['items']), 5)
+
+    def test_page_number_pagination_is_default(self):
+        response = self.client.get('/api/v1/catalog/')
+        self.assertEqual(response.json()['totalCount'], 15)
+
+    def test_checkouts_are_not_paginated_without_opt_in(self):
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get('/api/v1/checkouts/').json(), [])
+        response = self.client.get('/api/v1/checkouts/', {'pagination': 'cursor'})
+        self.assertEqual(response.json()['items'], [])
+
+
+class CatalogCacheTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.admin = User.objects.create_user(email='admin@example.com', is_staff=True)
+        self.category = GoodCategory.objects.create(title='Категория')
+        self.good = create_goods(self.category, self.seller, 1)[0]
+
+    def test_repeated_requests_are_served_from_cache(self):
+        response = self.client.get('/api/v1/catalog/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/catalog/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['items'][0]['name'], self.good.name)
+
+        self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_good_update_through_api_invalidates_cache(self):
+        self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        self.client.force_authenticate(self.seller)
+        self.client.patch(f'/api/v1/goods/{self.good.pk}/', {'name': 'Новое имя'}, format='json')
+        self.client.force_authenticate(None)
+
+        response = self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Новое имя')
+
+    def test_image_delete_invalidates_cache(self):
+        self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        self.good.images.first().delete()
+        response = self.client.get(f'/api/v1/catalog/{self.good.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['images']), 1)
+
+    def test_cache_stats_are_admin_only(self):
+        self.client.get('/api/v1/catalog/')
+        self.client.get('/api/v1/catalog/')
+        self.assertEqual(self.client.get('/api/v1/catalog/cache-stats/').status_code, 401)
+
+        self.client.force_authenticate(self.admin)
+        stats = self.client.get('/api/v1/catalog/cache-stats/').json()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+
+class CategoryTreeTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.root = GoodCategory.objects.create(title='Электроника')
+        self.phones = GoodCategory.objects.create(title='Телефоны', parent=self.root)
+        self.smartphones = GoodCategory.objects.create(title='Смартфоны', parent=self.phones)
+        self.other = GoodCategory.objects.create(title='Книги')
+
+    def test_paths_are_materialized(self):
+        self.assertEqual(self.smartphones.path, f'{self.root.pk}/{self.phones.pk}/{self.smartphones.pk}/')
+        self.assertEqual(self.smartphones.depth, 2)
+        self.assertEqual(self.smartphones.ancestor_ids, [self.root.pk, self.phones.pk])
+
+    def test_moving_category_rewrites_subtree(self):
+        self.phones.parent = self.other
+        self.phones.save()
+        self.smartphones.refresh_from_db()
+        self.assertEqual(self.smartphones.path, f'{self.other.pk}/{self.phones.pk}/{self.smartphones.pk}/')
+        self.assertEqual(self.smartphones.depth, 2)
+
+        self.phones.parent = None
+        self.phones.save()
+        self.smartphones.refresh_from_db()
+        self.assertEqual(self.smartphones.path, f'{self.phones.pk}/{self.smartphones.pk}/')
+        self.assertEqual(self.smartphones.depth, 1)
+
+    def test_ancestors_in_one_query(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/v1/good-categories/{self.smartphones.pk}/ancestors/')
+        self.assertEqual([item['id'] for item in response.json()], [self.root.pk, self.phones.pk])
+
+    def test_goods_of_subtree(self):
+        in_root = create_goods(self.root, self.seller, 1, images_per_good=0)
+        in_leaf = create_goods(self.smartphones, self.seller, 2, images_per_good=0)
+        create_goods(self.other, self.seller, 1, images_per_good=0)
+
+        self.assertEqual(
+            sorted(self.root.get_goods().values_list('pk', flat=True)),
+            sorted(good.pk for good in in_root + in_leaf),
+        )
+        response = self.client.get(f'/api/v1/good-categories/{self.phones.pk}/goods/')
+        self.assertEqual(response.json()['totalCount'], 2)
+
+    def test_cannot_move_category_into_its_descendant(self):
+        response = self.client.patch(
+            f'/api/v1/good-categories/{self.root.pk}/', {'parentId': self.smartphones.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_moving_category_invalidates_cached_catalog(self):
+        in_leaf = create_goods(self.smartphones, self.seller, 1, images_per_good=0)[0]
+        params = {'category': self.root.pk, 'include_descendants': 'true'}
+        response = self.client.get('/api/v1/catalog/', params)
+        self.assertEqual([item['id'] for item in response.json()['items']], [in_leaf.pk])
+        self.assertEqual(self.client.get('/api/v1/catalog/', params)['X-Cache'], 'HIT')
+
+        self.phones.parent = self.other
+        self.phones.save()
+        response = self.client.get('/api/v1/catalog/', params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['items'], [])
+        response = self.client.get('/api/v1/catalog/', {'category': self.other.pk, 'include_descendants': 'true'})
+        self.assertEqual([item['id'] for item in response.json()['items']], [in_leaf.pk])
+
+    def test_tree_keeps_creation_order_past_ten_categories(self):
+        parent = GoodCategory.objects.create(title='Много подкатегорий')
+        children = [GoodCategory.objects.create(title=f'Раздел {i}', parent=parent) for i in range(12)]
+        tree = self.client.get('/api/v1/good-categories/tree/').json()
+        node = next(node for node in tree if node['id'] == parent.pk)
+        self.assertEqual([child['id'] for child in node['children']], [child.pk for child in children])
+        self.assertEqual([root['id'] for root in tree], sorted(root['id'] for root in tree))
+
+    def test_tree_is_cached_until_categories_change(self):
+        response = self.client.get('/api/v1/good-categories/tree/')
+        tree = response.json()
+        self.assertEqual([node['title'] for node in tree], ['Электроника', 'Книги'])
+        self.assertEqual(tree[0]['children'][0]['children'][0]['id'], self.smartphones.pk)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/good-categories/tree/')
+
+        GoodCategory.objects.create(title='Планшеты', parent=self.root)
+        tree = self.client.get('/api/v1/good-categories/tree/').json()
+        self.assertEqual(len(tree[0]['children']), 2)
+
+
+class CatalogSearchTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        seller = User.objects.create_user(email='seller@example.com', role='seller')
+        category = GoodCategory.objects.create(title='Категория')
+        self.phone = Good.objects.create(
+            name='Смартфон Samsung Galaxy', description='Телефон с хорошей камерой',
+            price=Decimal('30000'), category=category, seller=seller,
+        )
+        self.case = Good.objects.create(
+            name='Чехол', description='Чехол для смартфона Samsung',
+            price=Decimal('500'), category=category, seller=seller,
+        )
+        self.book = Good.objects.create(
+            name='Книга', description='Roman', price=Decimal('700'), category=category, seller=seller,
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/v1/catalog/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['items']]
+
+    def test_prefix_search_in_russian_and_english(self):
+        self.assertEqual(self.search('смартф'), [self.phone.pk, self.case.pk])
+        self.assertEqual(self.search('sams'), [self.phone.pk, self.case.pk])
+        self.assertEqual(self.search('СМАРТФОН galaxy'), [self.phone.pk])
+        self.assertEqual(self.search('ноутбук'), [])
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self.search('чехол смартф')[0], self.case.pk)
+        self.assertEqual(self.search('samsung')[0], self.phone.pk)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.book.name = 'Книга про смартфоны'
+        self.book.save()
+        self.assertIn(self.book.pk, self.search('смартф'))
+
+        self.phone.delete()
+        self.assertNotIn(self.phone.pk, self.search('смартф'))
+
+    def test_empty_query_is_rejected(self):
+        response = self.client.get('/api/v1/catalog/search/', {'q': '  '})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(SEARCH_BACKEND='shop.search.LikeSearchBackend')
+    def test_fallback_backend_for_other_databases(self):
+        # Латиница: LIKE в SQLite без учёта регистра только для ASCII
+        self.assertEqual(self.search('SAMS'), [self.phone.pk, self.case.pk])
+        self.assertEqual(self.search('samsung galaxy'), [self.phone.pk])
+        self.assertEqual(self.search('roman'), [self.book.pk])
+        self.assertEqual(self.search('ноутбук'), [])
+
+    def test_base_backend_is_abstract(self):
+        with self.assertRaises(TypeError):
+            BaseSearchBackend()
+
+
+class CatalogFilterTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.other_seller = User.objects.create_user(email='other@example.com', role='seller')
+        self.root = GoodCategory.objects.create(title='Электроника')
+        self.child = GoodCategory.objects.create(title='Телефоны', parent=self.root)
+        self.cheap = Good.objects.create(
+            name='Б', price=Decimal('100'), category=self.root, seller=self.seller,
+        )
+        self.middle = Good.objects.create(
+            name='В', price=Decimal('500'), category=self.child, seller=self.other_seller,
+        )
+        self.expensive = Good.objects.create(
+            name='А', price=Decimal('900'), category=self.child, seller=self.seller,
+        )
+
+    def get_ids(self, **params):
+        response = self.client.get('/api/v1/catalog/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['items']]
+
+    def test_filters(self):
+        self.assertEqual(set(self.get_ids(category=self.root.pk)), {self.cheap.pk})
+        self.assertEqual(
+            set(self.get_ids(category=self.root.pk, include_descendants='true')),
+            {self.cheap.pk, self.middle.pk, self.expensive.pk},
+        )
+        self.assertEqual(set(self.get_ids(seller=self.seller.pk)), {self.cheap.pk, self.expensive.pk})
+        self.assertEqual(set(self.get_ids(price_min='200', price_max='900')), {self.middle.pk, self.expensive.pk})
+
+    def test_ordering(self):
+        self.assertEqual(self.get_ids(ordering='price'), [self.cheap.pk, self.middle.pk, self.expensive.pk])
+        self.assertEqual(self.get_ids(ordering='-price'), [self.expensive.pk, self.middle.pk, self.cheap.pk])
+        self.assertEqual(self.get_ids(ordering='name'), [self.expensive.pk, self.cheap.pk, self.middle.pk])
+        self.assertEqual(self.get_ids(ordering='-created'), [self.expensive.pk, self.middle.pk, self.cheap.pk])
+
+    def test_invalid_filter_value(self):
+        response = self.client.get('/api/v1/catalog/', {'price_min': 'дёшево'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_price_is_rejected(self):
+        for value in ('NaN', 'sNaN', 'Infinity', '-Infinity'):
+            response = self.client.get('/api/v1/catalog/', {'price_min': value})
+            self.assertEqual(response.status_code, 400, value)
+            response = self.client.get('/api/v1/catalog/', {'price_max': value})
+            self.assertEqual(response.status_code, 400, value)
+
+
+class CatalogIndexUsageTestCase(TestCase):
+    """
+    Проверяем по EXPLAIN, что частые комбинации фильтров идут по индексам Good.
+    """
+
+    def setUp(self):
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.category = GoodCategory.objects.create(title='Категория')
+        for price in (100, 200, 300):
+            Good.objects.create(name='Товар', price=price, category=self.category, seller=self.seller)
+
+    def explain_catalog_query(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/catalog/', params)
+        self.assertEqual(response.status_code, 200)
+        sql = next(
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "shop_good"."id"')
+        )
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # На пустой таблице планировщик всегда выберет seq scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(str(row) for row in cursor.fetchall())
+
+    def assertUsesIndex(self, params, index_name):
+        cache.clear()
+        plan = self.explain_catalog_query(params)
+        self.assertIn(index_name, plan)
+
+    def test_category_with_price_range(self):
+        self.assertUsesIndex(
+            {'category': self.category.pk, 'price_min': 100, 'price_max': 500, 'ordering': 'price'},
+            'good_category_price_idx',
+        )
+
+    def test_category_newest(self):
+        self.assertUsesIndex({'category': self.category.pk, 'ordering': '-created'}, 'good_category_created_idx')
+
+    def test_seller_by_price(self):
+        self.assertUsesIndex({'seller': self.seller.pk, 'ordering': 'price'}, 'good_seller_price_idx')
+
+    def test_price_range(self):
+        self.assertUsesIndex({'price_min': 100, 'price_max': 500}, 'good_price_idx')
+
+
+class CheckoutCreateTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.buyer = User.objects.create_user(email='buyer@example.com')
+        self.client.force_authenticate(self.buyer)
+        seller = User.objects.create_user(email='seller@example.com', role='seller')
+        category = GoodCategory.objects.create(title='Категория')
+        self.goods = [
+            Good.objects.create(name=f'Товар {i}', price=Decimal('10.50') * (i + 1), category=category, seller=seller)
+            for i in range(20)
+        ]
+        self.payload = {
+            'recipientId': Recipient.objects.create(
+                user=self.buyer, first_name='Иван', last_name='Иванов', address='Москва', zip_code='101000',
+                phone='+70000000000',
+            ).pk,
+            'paymentMethodId': PaymentMethod.objects.create(title='Карта').pk,
+            'deliveryMethodId': DeliveryMethod.objects.create(title='Курьер').pk,
+        }
+
+    def fill_basket(self, size):
+        BasketItem.objects.bulk_create(
+            BasketItem(user=self.buyer, good=good, count=2) for good in self.goods[:size]
+        )
+
+    def create_checkout(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/checkouts/', self.payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response, len(queries)
+
+    def test_checkout_moves_basket_and_computes_total(self):
+        self.fill_basket(3)
+        response, _ = self.create_checkout()
+        self.assertEqual(Decimal(response.json()['payment_total']), (Decimal('10.50') + 21 + Decimal('31.50')) * 2)
+        self.assertEqual(len(response.json()['items']), 3)
+        self.assertFalse(BasketItem.objects.filter(user=self.buyer).exists())
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        self.fill_basket(1)
+        _, small = self.create_checkout()
+        self.fill_basket(20)
+        _, large = self.create_checkout()
+        self.assertEqual(small, large)
+
+    def test_empty_basket(self):
+        response = self.client.post('/api/v1/checkouts/', self.payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Checkout.objects.exists())
+
+    def test_failure_rolls_back_everything(self):
+        self.fill_basket(3)
+        with mock.patch.object(CheckoutItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/v1/checkouts/', self.payload, format='json')
+        self.assertFalse(Checkout.objects.exists())
+        self.assertEqual(BasketItem.objects.filter(user=self.buyer).count(), 3)
+
+
+class BasketAddTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.buyer = User.objects.create_user(email='buyer@example.com')
+        self.client.force_authenticate(self.buyer)
+        seller = User.objects.create_user(email='seller@example.com', role='seller')
+        category = GoodCategory.objects.create(title='Категория')
+        self.goods = [
+            Good.objects.create(name=f'Товар {i}', price=Decimal('100'), category=category, seller=seller)
+            for i in range(3)
+        ]
+
+    def test_adding_same_good_increments_count(self):
+        good = self.goods[0]
+        response = self.client.post('/api/v1/me/basket-items/', {'goodId': good.pk, 'count': 2}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['count'], 2)
+
+        # Проверка товара + чтение существующих строк (в SQLite) + один upsert
+        with self.assertNumQueries(2 if connection.vendor == 'postgresql' else 3):
+            response = self.client.post(
+                '/api/v1/me/basket-items/', {'goodId': good.pk, 'count': 3}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 5)
+        self.assertEqual(response.json()['good']['name'], good.name)
+        self.assertEqual(BasketItem.objects.get(user=self.buyer, good=good).count, 5)
+
+    def test_existing_row_is_reported_as_update(self):
+        # Итог совпадает с добавленным количеством, но строка уже была — это не создание
+        BasketItem.objects.create(user=self.buyer, good=self.goods[0], count=0)
+        response = self.client.post(
+            '/api/v1/me/basket-items/', {'goodId': self.goods[0].pk, 'count': 2}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_non_positive_count_is_rejected(self):
+        response = self.client.post(
+            '/api/v1/me/basket-items/', {'goodId': self.goods[0].pk, 'count': 0}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BasketItem.objects.exists())
+
+    def test_bulk_add_merges_with_existing_basket(self):
+        BasketItem.objects.create(user=self.buyer, good=self.goods[0], count=1)
+        payload = [
+            {'goodId': self.goods[0].pk, 'count': 2},
+            {'goodId': self.goods[1].pk, 'count': 1},
+            {'goodId': self.goods[1].pk, 'count': 4},
+        ]
+        # Проверка товаров + чтение существующих строк (в SQLite) + один upsert + выборка результата
+        with self.assertNumQueries(3 if connection.vendor == 'postgresql' else 4):
+            response = self.client.post('/api/v1/me/basket-items/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        counts = {item['goodId']: item['count'] for item in response.json()}
+        self.assertEqual(counts, {self.goods[0].pk: 3, self.goods[1].pk: 5})
+
+    def test_bulk_add_limits_list_length(self):
+        payload = [{'goodId': self.goods[0].pk, 'count': 1}] * (BasketItemBulkAddSerializer.MAX_ITEMS + 1)
+        response = self.client.post('/api/v1/me/basket-items/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BasketItem.objects.exists())
+
+    def test_bulk_add_rejects_unknown_goods(self):
+        payload = [{'goodId': self.goods[0].pk, 'count': 1}, {'goodId': 999, 'count': 1}]
+        response = self.client.post('/api/v1/me/basket-items/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BasketItem.objects.exists())
+
+
+def create_checkout(user):
+    recipient = Recipient.objects.create(
+        user=user, first_name='Иван', last_name='Иванов', address='Москва', zip_code='101000', phone='+70000000000',
+    )
+    return Checkout.objects.create(
+        user=user,
+        recipient=recipient,
+        payment_method=PaymentMethod.objects.create(title='Карта'),
+        delivery_method=DeliveryMethod.objects.create(title='Курьер'),
+        payment_total=Decimal('1000'),
+    )
+
+
+class YookassaWebhookTestCase(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.checkout = create_checkout(User.objects.create_user(email='buyer@example.com'))
+        self.transaction = Transaction.objects.create(
+            checkout=self.checkout,
+            amount=Decimal('1000'),
+            provider_data=json.dumps({'id': 'pay-1', 'status': 'pending'}),
+            provider_payment_id='pay-1',
+        )
+
+    def post_webhook(self, payment_id, payment_status):
+        payload = {'event': f'payment.{payment_status}', 'object': {'id': payment_id, 'status': payment_status}}
+        return self.client.post('/api/v1/payment/yookassa/webhook/', payload, format='json')
+
+    def test_successful_payment_marks_checkout_paid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_webhook('pay-1', 'succeeded')
+        self.assertEqual(response.status_code, 200)
+        self.transaction.refresh_from_db()
+        self.checkout.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'SUCCESS')
+        self.assertTrue(self.checkout.is_paid)
+        self.assertEqual(self.checkout.status, 'PAID')
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+
+    def test_webhook_only_records_event(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_webhook('pay-1', 'succeeded')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(WebhookEvent.objects.get().event_key, 'payment.succeeded:pay-1')
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'PENDING')
+
+    def test_duplicate_events_are_noops(self):
+        queued = 0
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.assertEqual(self.post_webhook('pay-1', 'succeeded').status_code, 200)
+            queued += len(callbacks)
+        # Обработанное событие повторно в очередь не ставится
+        self.assertEqual(queued, 1)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual(process_webhook_event(event.pk), 'PROCESSED')
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 1)
+
+    def test_late_event_does_not_revert_success(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-1', 'succeeded')
+            self.post_webhook('pay-1', 'canceled')
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.status, 'SUCCESS')
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+    def test_unknown_payment_waits_for_transaction_then_fails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post_webhook('pay-unknown', 'succeeded').status_code, 200)
+        # Без брокера повторов подряд нет, а ожидание Transaction попыткой не считается
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('PENDING', 0))
+        self.assertEqual(process_webhook_event(event.pk), 'PENDING')
+        self.assertEqual(WebhookEvent.objects.get().attempts, 0)
+
+        WebhookEvent.objects.update(received=timezone.now() - WEBHOOK_TRANSACTION_WAIT)
+        for _ in range(WEBHOOK_MAX_ATTEMPTS):
+            status = process_webhook_event(event.pk)
+        self.assertEqual(status, 'FAILED')
+        self.assertEqual(WebhookEvent.objects.get().attempts, WEBHOOK_MAX_ATTEMPTS)
+
+    def test_transaction_created_later_is_picked_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-late', 'succeeded')
+        Transaction.objects.create(
+            checkout=self.checkout, amount=Decimal('1000'), provider_data={}, provider_payment_id='pay-late',
+        )
+        WebhookEvent.objects.update(received=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_pending_webhook_events(), 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+
+    def test_broker_failure_still_acknowledges_webhook(self):
+        with mock.patch.object(process_webhook_event, 'delay', side_effect=ConnectionError), \
+                self.assertLogs('shop.tasks', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.post_webhook('pay-1', 'succeeded')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().status, 'PENDING')
+
+    def test_redelivery_requeues_unprocessed_events(self):
+        with mock.patch.object(process_webhook_event, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-1', 'succeeded')
+        self.assertEqual(WebhookEvent.objects.get().status, 'PENDING')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-1', 'succeeded')
+        self.assertEqual(WebhookEvent.objects.get().status, 'PROCESSED')
+
+    def test_redelivery_resets_failed_event(self):
+        with mock.patch.object(process_webhook_event, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-1', 'succeeded')
+        WebhookEvent.objects.update(status='FAILED', attempts=WEBHOOK_MAX_ATTEMPTS)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_webhook('pay-1', 'succeeded')
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('PROCESSED', 1))
+        self.checkout.refresh_from_db()
+        self.assertTrue(self.checkout.is_paid)
+
+    def test_retries_back_off(self):
+        self.assertEqual([webhook_retry_countdown(n) for n in range(3)], [30, 60, 120])
+        self.assertEqual(webhook_retry_countdown(20), WEBHOOK_MAX_RETRY_DELAY)
+
+    def test_requeue_is_scheduled(self):
+        tasks = {entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn('shop.tasks.requeue_pending_webhook_events', tasks)
+
+    def test_backfill_reads_string_and_dict_provider_data(self):
+        from_string = Transaction.objects.create(
+            checkout=self.checkout, amount=Decimal('1'), provider_data=json.dumps({'id': 'pay-2'}),
+        )
+        from_dict = Transaction.objects.create(
+            checkout=self.checkout, amount=Decimal('1'), provider_data={'id': 'pay-3'},
+        )
+        migration = importlib.import_module('shop.migrations.0013_transaction_provider_payment_id')
+        migration.fill_provider_payment_id(apps, None)
+
+        from_string.refresh_from_db()
+        from_dict.refresh_from_db()
+        self.assertEqual(from_string.provider_payment_id, 'pay-2')
+        self.assertEqual(from_dict.provider_payment_id, 'pay-3')
+
+
+class ThumbnailPipelineTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.client.force_authenticate(self.seller)
+        self.good = create_goods(GoodCategory.objects.create(title='Категория'), self.seller, 1, images_per_good=0)[0]
+
+    def upload(self, *files):
+        return self.client.post(
+            f'/api/v1/goods/{self.good.pk}/upload_image/', {'image': list(files)}, format='multipart'
+        )
+
+    def test_upload_returns_before_thumbnails_are_built(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.upload(make_image_file('a.png'), make_image_file('b.png'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([image['thumbnail_status'] for image in response.json()['images']], ['pending', 'pending'])
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(GoodImage.objects.filter(thumbnail_status='ready').exists())
+
+    def test_files_are_stored_in_parallel_and_inserted_at_once(self):
+        files = [make_image_file(f'{i}.png', size=(40, 40)) for i in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.upload(*files)
+        self.assertEqual(response.status_code, 200)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "shop_goodimage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(callbacks), 5)
+        names = list(GoodImage.objects.order_by('pk').values_list('image', flat=True))
+        self.assertEqual([name.split('/')[-1] for name in names], [f'{i}.png' for i in range(5)])
+        self.assertTrue(all(GoodImage._meta.get_field('image').storage.exists(name) for name in names))
+
+    def test_upload_invalidates_catalog_cache(self):
+        self.client.get('/api/v1/catalog/')
+        self.upload(make_image_file())
+        self.assertEqual(self.client.get('/api/v1/catalog/')['X-Cache'], 'MISS')
+
+    def test_thumbnail_is_built_in_background(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(make_image_file('a.png', size=(1200, 600)))
+        image = GoodImage.objects.get()
+        self.assertEqual(image.thumbnail_status, 'ready')
+        with Image.open(image.thumbnail) as thumbnail:
+            self.assertEqual(thumbnail.size, (300, 150))
+
+    def test_retry_replaces_thumbnail_of_failed_attempt(self):
+        image = GoodImage.objects.create(good=self.good, image=make_image_file('retry.png'))
+        storage = GoodImage._meta.get_field('thumbnail').storage
+        # Превью построилось, а рендишены упали — задача уходит в ретрай и строит превью заново
+        with mock.patch('shop.tasks.build_renditions', side_effect=[OSError('S3 недоступен'), []]):
+            self.assertEqual(generate_thumbnail.apply(args=[image.pk]).get(), 'ready')
+        image.refresh_from_db()
+        thumbs = [name for name in storage.listdir('goods/thumbs/')[1] if name.startswith('thumb_retry')]
+        self.assertEqual(thumbs, [image.thumbnail.name.split('/')[-1]])
+
+    def test_images_left_pending_can_be_queued(self):
+        pending = GoodImage.objects.create(good=self.good, image=make_image_file('old.png'))
+        failed = GoodImage.objects.create(good=self.good, image=make_image_file('bad.png'), thumbnail_status='failed')
+        out = StringIO()
+        with mock.patch.object(generate_thumbnail, 'delay') as delay:
+            call_command('queue_thumbnails', stdout=out)
+            delay.assert_called_once_with(pending.pk)
+            delay.reset_mock()
+            call_command('queue_thumbnails', '--failed', stdout=out)
+            self.assertEqual(sorted(call.args[0] for call in delay.call_args_list), [pending.pk, failed.pk])
+
+    def test_broken_upload_is_marked_failed_after_retries(self):
+        broken = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        image = GoodImage.objects.create(good=self.good, image=broken)
+        self.assertEqual(generate_thumbnail.apply(args=[image.pk]).get(propagate=False), 'failed')
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnail_status, 'failed')
+
+
+class MediaUrlTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        clear_url_cache()
+        self.addCleanup(clear_url_cache)
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.client.force_authenticate(self.seller)
+        self.good = create_goods(GoodCategory.objects.create(title='Категория'), self.seller, 1, images_per_good=3)[0]
+        self.storage = GoodImage._meta.get_field('image').storage
+
+    def test_urls_are_computed_once_per_file(self):
+        with mock.patch.object(self.storage, 'url', wraps=self.storage.url) as url:
+            first = self.client.get(f'/api/v1/goods/{self.good.pk}/').json()
+            calls = url.call_count
+            second = self.client.get(f'/api/v1/goods/{self.good.pk}/').json()
+            listed = self.client.get('/api/v1/catalog/').json()
+        # Оригинал и превью у каждой картинки
+        self.assertEqual(calls, 2 * GoodImage.objects.count())
+        self.assertEqual(url.call_count, calls)
+        self.assertEqual(first, second)
+        self.assertEqual(listed['items'][0]['thumbnail'], first['images'][0]['thumbnail'])
+        self.assertTrue(first['images'][0]['image'].startswith('http://media.test/goods/'))
+
+    def test_new_file_gets_new_url(self):
+        image = GoodImage.objects.first()
+        before = storage_url(self.storage, image.image.name)
+        image.image.save('replacement.png', make_image_file())
+        self.assertNotEqual(storage_url(self.storage, image.image.name), before)
+
+    @override_settings(MEDIA_CDN_URL='https://cdn.test/')
+    def test_cdn_base_url(self):
+        with mock.patch.object(self.storage, 'url') as url:
+            data = self.client.get(f'/api/v1/goods/{self.good.pk}/').json()
+        url.assert_not_called()
+        image = GoodImage.objects.get(pk=data['images'][0]['id'])
+        self.assertEqual(data['images'][0]['image'], f'https://cdn.test/{image.image.name}')
+
+    def test_signed_urls_expire_before_signature(self):
+        storage = S3Boto3Storage(bucket_name='test', querystring_auth=True, querystring_expire=600)
+        with mock.patch.object(storage, 'url', side_effect=['signed-1', 'signed-2']), \
+                mock.patch('shop.media.time.monotonic', side_effect=[0, 299, 301]):
+            self.assertEqual(storage_url(storage, 'a.png'), 'signed-1')
+            self.assertEqual(storage_url(storage, 'a.png'), 'signed-1')
+            self.assertEqual(storage_url(storage, 'a.png'), 'signed-2')
+
+
+class DirectUploadTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.client.force_authenticate(self.seller)
+        self.good = create_goods(GoodCategory.objects.create(title='Категория'), self.seller, 1, images_per_good=0)[0]
+        self.storage = GoodImage._meta.get_field('image').storage
+
+    def put_object(self, name):
+        # Так файл оказывается в хранилище после загрузки клиентом по presigned URL
+        return self.storage.save(name, make_image_file(size=(600, 300)))
+
+    def finalize(self, keys):
+        return self.client.post(f'/api/v1/goods/{self.good.pk}/finalize-upload/', {'keys': keys}, format='json')
+
+    def test_finalize_registers_uploaded_objects(self):
+        keys = [self.put_object(f'goods/uploads/{self.good.pk}/{i}.png') for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.finalize(keys)
+        self.assertEqual(response.status_code, 201)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "shop_goodimage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(sorted(GoodImage.objects.values_list('image', flat=True)), sorted(keys))
+        self.assertFalse(GoodImage.objects.exclude(thumbnail_status='ready').exists())
+
+    def test_finalize_rejects_keys_of_other_goods(self):
+        other = create_goods(self.good.category, self.seller, 1, images_per_good=0)[0]
+        key = self.put_object(f'goods/uploads/{other.pk}/a.png')
+        response = self.finalize([key, f'goods/uploads/{self.good.pk}/../{other.pk}/a.png'])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GoodImage.objects.exists())
+
+    def test_finalize_rejects_missing_and_registered_objects(self):
+        self.assertEqual(self.finalize([f'goods/uploads/{self.good.pk}/missing.png']).status_code, 400)
+
+        key = self.put_object(f'goods/uploads/{self.good.pk}/a.png')
+        self.assertEqual(self.finalize([key]).status_code, 201)
+        self.assertEqual(self.finalize([key]).status_code, 400)
+        self.assertEqual(GoodImage.objects.count(), 1)
+
+    def test_upload_urls_need_s3_storage(self):
+        response = self.client.post(
+            f'/api/v1/goods/{self.good.pk}/upload-urls/',
+            {'files': [{'name': 'a.jpg', 'contentType': 'image/jpeg', 'size': 100}]}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_unfinalized_uploads_are_purged(self):
+        registered = self.put_object(f'goods/uploads/{self.good.pk}/a.png')
+        abandoned = self.put_object(f'goods/uploads/{self.good.pk}/b.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.finalize([registered]).status_code, 201)
+
+        # Свежие файлы не трогаем: клиент ещё может вызвать finalize
+        purge_unfinalized_uploads()
+        self.assertTrue(self.storage.exists(abandoned))
+        # Хранилище общее на класс, в нём могут остаться файлы соседних тестов
+        with override_settings(IMAGE_DIRECT_UPLOAD_CLEANUP_AGE=-60):
+            self.assertGreaterEqual(purge_unfinalized_uploads(), 1)
+        self.assertTrue(self.storage.exists(registered))
+        self.assertFalse(self.storage.exists(abandoned))
+        tasks = {entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn('shop.tasks.purge_unfinalized_uploads', tasks)
+
+    def test_storage_key_uses_location_prefix(self):
+        storage = S3Boto3Storage(bucket_name='test', location='media')
+        self.assertEqual(storage_key(storage, 'goods/uploads/1/a b.png'), 'media/goods/uploads/1/a_b.png')
+        self.assertEqual(storage_key(S3Boto3Storage(bucket_name='test'), 'goods/a.png'), 'goods/a.png')
+
+    def test_other_seller_cannot_finalize(self):
+        key = self.put_object(f'goods/uploads/{self.good.pk}/a.png')
+        self.client.force_authenticate(User.objects.create_user(email='other@example.com', role='seller'))
+        self.assertEqual(self.finalize([key]).status_code, 404)
+        self.assertFalse(GoodImage.objects.exists())
+
+
+@skipUnless(importlib.util.find_spec('moto'), 'нужен moto')
+class DirectUploadS3TestCase(TestCase):
+    """
+    Полный цикл против S3-заглушки moto: presigned POST -> загрузка мимо Django -> finalize.
+    """
+
+    def setUp(self):
+        from moto import mock_aws
+        self.aws = mock_aws()
+        self.aws.start()
+        self.addCleanup(self.aws.stop)
+        options = {
+            'bucket_name': 'test', 'endpoint_url': None, 'region_name': 'us-east-1',
+            'access_key': 'testing', 'secret_key': 'testing',
+        }
+        storage = S3Boto3Storage(**options)
+        storage.connection.meta.client.create_bucket(Bucket='test')
+        for model, field_name in InMemoryImageStorageMixin.storage_fields:
+            field = model._meta.get_field(field_name)
+            self.addCleanup(setattr, field, 'storage', field.storage)
+            field.storage = storage
+
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.client.force_authenticate(self.seller)
+        self.good = create_goods(GoodCategory.objects.create(title='Категория'), self.seller, 1, images_per_good=0)[0]
+
+    def request_urls(self, *files):
+        return self.client.post(f'/api/v1/goods/{self.good.pk}/upload-urls/', {'files': list(files)}, format='json')
+
+    def test_presigned_upload_and_finalize(self):
+        content = make_image_file(size=(800, 400)).read()
+        response = self.request_urls({'name': 'photo.PNG', 'contentType': 'image/png', 'size': len(content)})
+        self.assertEqual(response.status_code, 200)
+        upload = response.json()['uploads'][0]
+        self.assertTrue(upload['key'].startswith(f'goods/uploads/{self.good.pk}/'))
+        self.assertTrue(upload['key'].endswith('.png'))
+
+        s3 = requests.post(upload['url'], data=upload['fields'], files={'file': ('photo.png', content)})
+        self.assertEqual(s3.status_code, 204, s3.text)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/v1/goods/{self.good.pk}/finalize-upload/', {'keys': [upload['key']]}, format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        image = GoodImage.objects.get()
+        self.assertEqual(image.thumbnail_status, 'ready')
+        self.assertTrue(image.renditions.exists())
+
+    def test_policy_pins_size_and_type(self):
+        # moto не проверяет политику при загрузке, поэтому смотрим на саму подписанную политику
+        upload = self.request_urls({'name': 'a.png', 'contentType': 'image/png', 'size': 1234}).json()['uploads'][0]
+        policy = json.loads(base64.b64decode(upload['fields']['policy']))
+        self.assertIn(['content-length-range', 1234, 1234], policy['conditions'])
+        self.assertIn({'Content-Type': 'image/png'}, policy['conditions'])
+        self.assertIn({'key': upload['key']}, policy['conditions'])
+
+    def test_request_is_validated(self):
+        self.assertEqual(self.request_urls({'name': 'a.gif', 'contentType': 'image/gif', 'size': 10}).status_code, 400)
+        self.assertEqual(self.request_urls().status_code, 400)
+
+
+class RenditionTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user(email='seller@example.com', role='seller')
+        self.good = create_goods(GoodCategory.objects.create(title='Категория'), seller, 1, images_per_good=0)[0]
+
+    @override_settings(IMAGE_RENDITION_WIDTHS=[320, 640, 1600], IMAGE_RENDITION_FORMATS=['avif', 'webp', 'jpeg'])
+    def test_renditions_for_each_width_and_supported_format(self):
+        image = GoodImage.objects.create(good=self.good, image=make_image_file(size=(1000, 500)))
+        build_renditions(image)
+
+        formats = available_formats()
+        self.assertIn('webp', formats)
+        renditions = image.renditions.all()
+        self.assertEqual(
+            sorted((r.width, r.height, r.format) for r in renditions),
+            sorted((width, width // 2, fmt) for width in (320, 640, 1000) for fmt in formats),
+        )
+        webp = next(r for r in renditions if r.format == 'webp' and r.width == 320)
+        with Image.open(webp.file) as rendered:
+            self.assertEqual((rendered.format, rendered.size), ('WEBP', (320, 160)))
+
+    def test_rebuild_replaces_old_renditions(self):
+        image = GoodImage.objects.create(good=self.good, image=make_image_file(size=(700, 700)))
+        build_renditions(image)
+        count = image.renditions.count()
+        old_names = list(image.renditions.values_list('file', flat=True))
+        storage = GoodImageRendition._meta.get_field('file').storage
+        with self.captureOnCommitCallbacks(execute=True):
+            build_renditions(image)
+        self.assertEqual(image.renditions.count(), count)
+        # Файлы старых рендишенов удалены из хранилища, новые на месте
+        self.assertFalse(any(storage.exists(name) for name in old_names))
+        self.assertTrue(all(storage.exists(r.file.name) for r in image.renditions.all()))
+
+    def test_upload_pipeline_builds_renditions(self):
+        client = APIClient()
+        client.force_authenticate(self.good.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(f'/api/v1/goods/{self.good.pk}/upload_image/', {'image': make_image_file()}, format='multipart')
+        image = GoodImage.objects.get()
+        self.assertEqual(image.thumbnail_status, 'ready')
+        self.assertTrue(image.renditions.exists())
+
+
+class MetricsMiddlewareTestCase(InMemoryImageStorageMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics_registry.clear()
+        self.addCleanup(metrics_registry.clear)
+        self.client = APIClient()
+        seller = User.objects.create_user(email='seller@example.com', role='seller')
+        create_goods(GoodCategory.objects.create(title='Категория'), seller, 3)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/v1/catalog/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_prometheus_endpoint(self):
+        self.client.get('/api/v1/catalog/')
+        self.client.get('/api/v1/catalog/')
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        labels = 'view="catalog-list",method="GET",status="200"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', body)
+        # Второй запрос отдан из кэша: SQL и сериализация только у первого
+        self.assertIn(f'http_request_db_queries_total{{{labels}}} 3', body)
+        self.assertIn(f'http_request_serialize_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'http_request_serialize_seconds_bucket{{{labels},le="+Inf"}} 1', body)
+
+    def test_serialization_time_includes_lazy_queries(self):
+        # Время SQL, сделанного внутри .data, попадает в serialize, а не только в db
+        request = mock.Mock(metrics=RequestMetrics(capture_sql=False))
+        goods = list(Good.objects.all())
+        with connection.execute_wrapper(request.metrics.execute_wrapper):
+            data = GoodListSerializer(goods, many=True, context={'request': request}).data
+        self.assertEqual(len(data), 3)
+        # Без prefetch картинки читаются по запросу на товар
+        self.assertEqual(request.metrics.queries, 3)
+        self.assertTrue(request.metrics.serialized)
+        self.assertGreater(request.metrics.serialize_db_seconds, 0)
+        self.assertGreaterEqual(request.metrics.serialize_seconds, request.metrics.serialize_db_seconds)
+
+    def test_metrics_endpoint_is_hidden_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=100)
+    def test_slow_request_is_logged_with_sql(self):
+        with mock.patch('onlineStores.metrics.RequestMetrics.total_seconds', new_callable=mock.PropertyMock,
+                        return_value=0.5), \
+                self.assertLogs('onlineStores.metrics', 'WARNING') as logs:
+            self.client.get('/api/v1/catalog/')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('catalog-list', logs.output[0])
+        self.assertIn('FROM "shop_good"', logs.output[0])
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=100)
+    def test_fast_request_is_not_logged(self):
+        with mock.patch('onlineStores.metrics.logger.warning') as warning:
+            self.client.get('/api/v1/catalog/')
+        warning.assert_not_called()
+
+
+class StructuredLoggingTestCase(TestCase):
+
+    def make_record(self, msg, *args, exc_info=None, extra=None):
+        record = logging.getLogger('shop.test').makeRecord(
+            'shop.test', logging.INFO, __file__, 1, msg, args, exc_info, extra=extra,
+        )
+        RequestIdFilter().filter(record)
+        return record
+
+    def test_request_id_is_generated_and_echoed(self):
+        response = self.client.get('/api/v1/catalog/')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+        response = self.client.get('/api/v1/catalog/', HTTP_X_REQUEST_ID='lb-123')
+        self.assertEqual(response['X-Request-ID'], 'lb-123')
+
+        response = self.client.get('/api/v1/catalog/', HTTP_X_REQUEST_ID='bad id\n')
+        self.assertNotEqual(response['X-Request-ID'], 'bad id\n')
+
+    def test_json_record_has_request_id_and_extra(self):
+        token = request_id_var.set('req-1')
+        try:
+            record = self.make_record('Платёж %s', 'pay-1', extra={'checkout_id': 7})
+        finally:
+            request_id_var.reset(token)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['message'], 'Платёж pay-1')
+        self.assertEqual(data['request_id'], 'req-1')
+        self.assertEqual(data['checkout_id'], 7)
+        self.assertEqual(data['level'], 'INFO')
+
+    def test_queue_handler_writes_in_background(self):
+        stream = StringIO()
+        handler = QueueStreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RequestIdFilter())
+        try:
+            raise ValueError('сломалось')
+        except ValueError:
+            record = self.make_record('Ошибка', exc_info=sys.exc_info())
+        handler.handle(record)
+        handler.close()
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data['message'], 'Ошибка')
+        self.assertIn('ValueError: сломалось', data['exc_info'])
+
+    def test_queue_handler_defaults_to_stderr(self):
+        handler = QueueStreamHandler()
+        handler.close()
+        self.assertIs(handler.target.stream, sys.stderr)
+
+    def test_webhook_is_logged_instead_of_printed(self):
+        body = json.dumps({'event': 'payment.succeeded', 'object': {'id': 'pay-1', 'status': 'succeeded'}})
+        with self.assertLogs('shop.views', 'INFO') as logs, \
+                mock.patch('builtins.print') as print_, mock.patch.object(process_webhook_event, 'delay'):
+            self.client.post('/api/v1/payment/yookassa/webhook/', body, content_type='application/json')
+        self.assertIn('payment_id=pay-1', logs.output[0])
+        print_.assert_not_called()
+
+
+class DatabaseSettingsTestCase(TestCase):
+
+    @skipUnless(connection.vendor == 'sqlite', 'только SQLite')
+    def test_sqlite_pragmas_are_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], connection.settings_dict['OPTIONS']['timeout'] * 1000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    @skipUnless(connection.vendor == 'sqlite', 'только SQLite')
+    def test_sqlite_file_database_uses_wal(self):
+        # Тестовая база SQLite в памяти, WAL проверяем на файле с теми же настройками
+        with tempfile.TemporaryDirectory() as directory:
+            params = {**connection.get_connection_params(), 'database': f'{directory}/wal.sqlite3'}
+            raw = connection.get_new_connection(params)
+            try:
+                self.assertEqual(raw.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            finally:
+                raw.close()
+
+    @skipUnless(connection.vendor == 'postgresql', 'только PostgreSQL')
+    def test_postgresql_reuses_connections(self):
+        settings_dict = connection.settings_dict
+        self.assertTrue(settings_dict['CONN_HEALTH_CHECKS'])
+        if settings_dict['OPTIONS'].get('pool'):
+            self.assertEqual(settings_dict['CONN_MAX_AGE'], 0)
+            self.assertIsNotNone(connection.pool)
+        else:
+            self.assertGreater(settings_dict['CONN_MAX_AGE'], 0)
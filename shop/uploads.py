@@ -0,0 +1,119 @@
+import os
+import posixpath
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .models import GoodImage
+from . import cache as shop_cache
+from .tasks import DIRECT_UPLOAD_ROOT, queue_thumbnails
+
+
+_executors = {}
+
+
+def get_upload_executor():
+    """
+    Общий пул потоков на процесс. Потоки живут между запросами, поэтому
+    S3-клиент (django-storages держит его в threading.local) создаётся один раз на поток.
+    """
+    workers = settings.IMAGE_UPLOAD_WORKERS
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-upload')
+    return _executors[workers]
+
+
+def store_files(field, files):
+    """
+    Параллельно кладёт файлы в хранилище поля (для S3 — отдельный PUT на каждый файл,
+    большие файлы уходят multipart-загрузкой по AWS_S3_TRANSFER_CONFIG).
+    Возвращает имена сохранённых файлов в том же порядке.
+    """
+    def store(upload):
+        name = field.generate_filename(None, upload.name)
+        return field.storage.save(name, upload, max_length=field.max_length)
+
+    if settings.IMAGE_UPLOAD_WORKERS <= 1 or len(files) == 1:
+        return [store(upload) for upload in files]
+    return list(get_upload_executor().map(store, files))
+
+
+def add_good_images(good, names):
+    """
+    Создаёт строки GoodImage для уже лежащих в хранилище файлов одним INSERT.
+    bulk_create не шлёт post_save, поэтому кэш каталога и превью обрабатываем здесь.
+    """
+    with db_transaction.atomic():
+        images = GoodImage.objects.bulk_create(GoodImage(good=good, image=name) for name in names)
+        queue_thumbnails(images)
+    shop_cache.bump_version(shop_cache.CATALOG)
+    return images
+
+
+def create_good_images(good, files):
+    """
+    Загружает оригиналы через приложение и регистрирует их.
+    """
+    names = store_files(GoodImage._meta.get_field('image'), files)
+    return add_good_images(good, names)
+
+
+# --- Прямая загрузка в S3 ---
+# Клиент получает presigned POST, кладёт файл в бакет сам и вызывает finalize,
+# байты картинки через приложение не проходят.
+
+def direct_upload_storage():
+    """
+    Хранилище оригиналов, если оно умеет выдавать presigned URL (S3), иначе None.
+    """
+    storage = GoodImage._meta.get_field('image').storage
+    return storage if hasattr(storage, 'bucket') else None
+
+
+def direct_upload_prefix(good):
+    return f'{DIRECT_UPLOAD_ROOT}{good.pk}/'
+
+
+def storage_key(storage, name):
+    """
+    Ключ объекта в бакете для имени файла в хранилище: имя проходит ту же очистку,
+    что и при save(), и получает префикс AWS_LOCATION.
+    """
+    name = storage.generate_filename(name)
+    location = (storage.location or '').strip('/')
+    return posixpath.join(location, name) if location else name
+
+
+def presign_image_upload(good, filename, content_type, size):
+    """
+    Presigned POST на один файл. Ключ генерирует сервер, а тип и точный размер
+    зашиты в политику, так что S3 не примет другой файл.
+    """
+    storage = direct_upload_storage()
+    extension = os.path.splitext(filename)[1].lower()[:10]
+    name = storage.generate_filename(f'{direct_upload_prefix(good)}{uuid.uuid4().hex}{extension}')
+    post = storage.connection.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=storage_key(storage, name),
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', size, size],
+        ],
+        ExpiresIn=settings.IMAGE_DIRECT_UPLOAD_EXPIRES,
+    )
+    return {'key': name, 'url': post['url'], 'fields': post['fields']}
+
+
+def missing_uploads(names):
+    """
+    Ключи, которых нет в хранилище. Проверка — HEAD на каждый ключ, параллельно.
+    """
+    storage = GoodImage._meta.get_field('image').storage
+    if settings.IMAGE_UPLOAD_WORKERS <= 1 or len(names) == 1:
+        exists = [storage.exists(name) for name in names]
+    else:
+        exists = list(get_upload_executor().map(storage.exists, names))
+    return [name for name, found in zip(names, exists) if not found]
@@ -5,20 +5,34 @@ from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_MET
 from rest_framework.exceptions import PermissionDenied
 import uuid
 import json
+import hashlib
+import logging
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import DecimalField, F, Sum
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, permissions, mixins, status, serializers
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
 
+from users import roles
 from .models import GoodCategory, Good, PaymentMethod, DeliveryMethod, Recipient, Checkout, Transaction, BasketItem, \
-    CheckoutItem, GoodImage
+    CheckoutItem, GoodImage, WebhookEvent
 from .serializers import GoodCategorySerializer, GoodSerializer, PaymentMethodSerializer, DeliveryMethodSerializer, \
-    RecipientSerializer, BasketItemSerializer, CheckoutSerializer, TransactionSerializer
+    RecipientSerializer, BasketItemSerializer, BasketItemBulkAddSerializer, CheckoutSerializer, TransactionSerializer, \
+    GoodImageSerializer, GoodImageUploadRequestSerializer, GoodListSerializer, GoodImageFinalizeSerializer
 from .permission import IsSellerOrAdmin, IsSellerAndOwnerOrReadOnly, IsAdminOnly, IsSellerOnly
+from . import cache as shop_cache
+from .search import get_backend as get_search_backend
+from .filters import GoodFilterBackend, GoodOrderingFilter
+from .tasks import enqueue_webhook_event
+from .uploads import add_good_images, create_good_images, direct_upload_storage, presign_image_upload
+
+logger = logging.getLogger(__name__)
 
 
 Configuration.account_id = settings.YOOKASSA_SHOP_ID
@@ -56,7 +70,8 @@ def initiate_yookassa_payment(request):
         checkout=checkout,
         status='PENDING',
         amount=checkout.payment_total,
-        provider_data=payment.json()
+        provider_data=payment.json(),
+        provider_payment_id=payment.id
     )
 
     return Response({
@@ -68,37 +83,44 @@ def initiate_yookassa_payment(request):
 @csrf_exempt
 @api_view(['POST'])
 def yookassa_webhook(request):
+    """
+    Только записывает событие в inbox и сразу отвечает 200.
+    Статусы транзакции и заказа меняет задача process_webhook_event.
+    """
     try:
         payload = json.loads(request.body.decode('utf-8'))
         object_data = payload.get('object', {})
         payment_id = object_data.get('id')
-        status = object_data.get('status')
+        event_type = payload.get('event') or object_data.get('status')
 
-        print(f"🔔 Webhook пришёл! payment_id={payment_id}, status={status}")
+        logger.info('Webhook ЮKassa: payment_id=%s event=%s', payment_id, event_type)
 
         if not payment_id:
             return Response({"error": "payment_id отсутствует"}, status=400)
 
-        transaction = Transaction.objects.filter(provider_data__id=payment_id).first()
-        if not transaction:
-            return Response({"error": "Transaction не найдена"}, status=404)
-
-        # Обновляем статус
-        transaction.status = 'SUCCESS' if status == 'succeeded' else 'ERROR'
-        transaction.provider_data = object_data
-        transaction.save()
-
-        # Обновляем заказ
-        if status == 'succeeded':
-            checkout = transaction.checkout
-            checkout.is_paid = True
-            checkout.status = 'PAID'
-            checkout.save()
-
+        event_key = f'{event_type}:{payment_id}'
+        try:
+            with db_transaction.atomic():
+                event = WebhookEvent.objects.create(
+                    provider='yookassa',
+                    event_key=event_key,
+                    payload=payload
+                )
+        except IntegrityError:
+            # Повторная доставка того же события: обработанное пропускаем,
+            # необработанное (в том числе FAILED) ставим в очередь заново
+            event = WebhookEvent.objects.filter(provider='yookassa', event_key=event_key).first()
+            if event is None or event.status == 'PROCESSED':
+                return Response({"message": "OK"}, status=200)
+            if event.status == 'FAILED':
+                WebhookEvent.objects.filter(pk=event.pk, status='FAILED').update(status='PENDING', attempts=0)
+
+        # Событие уже сохранено в inbox, поэтому даже без брокера отвечаем 200
+        db_transaction.on_commit(lambda: enqueue_webhook_event(event.pk))
         return Response({"message": "OK"}, status=200)
 
     except Exception as e:
-        print("Ошибка в webhook:", e)
+        logger.exception('Ошибка в webhook ЮKassa')
         return Response({"error": str(e)}, status=500)
 
 
@@ -114,60 +136,279 @@ class CustomPagination(PageNumberPagination):
         })
 
 
+class CustomCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация: страница выбирается по индексу первичного ключа,
+    без OFFSET и без COUNT(*). Общее количество отдаётся только по ?withTotal=true
+    и кэшируется.
+    """
+    page_size = 10
+    ordering = '-id'
+    total_count_query_param = 'withTotal'
+    total_count_cache_timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.total_count = None
+        if request.query_params.get(self.total_count_query_param) in ('1', 'true'):
+            self.total_count = self.get_total_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_total_count(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.md5(f'{sql}:{params}'.encode('utf-8')).hexdigest()
+        key = f'pagination:count:{digest}'
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.total_count_cache_timeout)
+        return count
+
+    def get_paginated_response(self, data):
+        response = {
+            'nextPage': self.get_next_link(),
+            'prevPage': self.get_previous_link(),
+            'items': data
+        }
+        if self.total_count is not None:
+            response['totalCount'] = self.total_count
+        return Response(response)
+
+
+class CursorPaginationMixin:
+    """
+    Включает курсорную пагинацию по запросу: ?pagination=cursor.
+    Без параметра вьюха пагинируется как раньше (pagination_class).
+    """
+    cursor_pagination_class = CustomCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request is not None and self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                return super().paginator
+        return self._paginator
+
+
+class GoodListSerializerMixin:
+    """
+    Списки товаров отдаются компактным GoodListSerializer, остальные действия — полным serializer_class.
+    Для списков и запрос легче: без описания, связанных объектов и рендишенов.
+    """
+    list_actions = ('list', 'search')
+    list_serializer_class = GoodListSerializer
+    # Поля сортировки тоже нужны: курсорная пагинация читает их у крайних строк страницы
+    list_fields = tuple(dict.fromkeys(['id', 'name', 'price', *GoodOrderingFilter.ordering_fields]))
+
+    def get_serializer_class(self):
+        if self.action in self.list_actions:
+            return self.list_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.list_actions:
+            queryset = queryset.select_related(None).prefetch_related(None).only(*self.list_fields) \
+                .prefetch_related('images')
+        return queryset
+
+
 # --- Категории ---
 class GoodCategoryViewSet(viewsets.ModelViewSet):
     queryset = GoodCategory.objects.all()
     serializer_class = GoodCategorySerializer
     pagination_class = CustomPagination
 
-
-class PublicGoodViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Good.objects.all()
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """
+        Всё дерево категорий для меню витрины: один запрос, результат кэшируется
+        до следующего изменения категорий.
+        """
+        key = shop_cache.request_cache_key(shop_cache.CATEGORIES, request)
+        data = shop_cache.get_cached(shop_cache.CATEGORIES, key)
+        if data is None:
+            nodes = {}
+            data = []
+            # path — строка, и '10/' в ней идёт раньше '2/', поэтому сортируем по глубине и id
+            for category in GoodCategory.objects.order_by('depth', 'id'):
+                node = {
+                    'id': category.id,
+                    'title': category.title,
+                    'parentId': category.parent_id,
+                    'children': [],
+                }
+                nodes[category.id] = node
+                # Сортировка по глубине гарантирует, что родитель уже обработан
+                siblings = nodes[category.parent_id]['children'] if category.parent_id else data
+                siblings.append(node)
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    def ancestors(self, request, pk=None):
+        category = self.get_object()
+        serializer = self.get_serializer(category.get_ancestors(), many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def goods(self, request, pk=None):
+        category = self.get_object()
+        queryset = category.get_goods().only('id', 'name', 'price').prefetch_related('images').order_by('-id')
+        page = self.paginate_queryset(queryset)
+        serializer = GoodListSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class PublicGoodViewSet(GoodListSerializerMixin, CursorPaginationMixin, viewsets.ReadOnlyModelViewSet):
+    # Порядок по умолчанию тот же, что у курсорной пагинации: сначала новые
+    queryset = Good.objects.select_related('category', 'seller').prefetch_related('images__renditions').order_by('-id')
     serializer_class = GoodSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = CustomPagination
-
-
-class GoodViewSet(viewsets.ModelViewSet):
+    filter_backends = [GoodFilterBackend, GoodOrderingFilter]
+    cache_timeout = settings.CATALOG_CACHE_TIMEOUT
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """
+        Read-through кэш: ответ не зависит от пользователя, поэтому ключ строится
+        только по версии каталога, пути и параметрам запроса.
+        """
+        key = shop_cache.request_cache_key(shop_cache.CATALOG, request)
+        data = shop_cache.get_cached(shop_cache.CATALOG, key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        return self.cached_response(self.search_goods, request)
+
+    def search_goods(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Параметр q обязателен'}, status=400)
+
+        # Индекс отдаёт id по релевантности, страницу товаров достаём одним запросом
+        ids = get_search_backend().search(query, settings.SEARCH_MAX_RESULTS)
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(ids, request, view=self)
+        goods = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer([goods[pk] for pk in page if pk in goods], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAdminOnly])
+    def cache_stats(self, request):
+        return Response(shop_cache.get_stats(shop_cache.CATALOG))
+
+
+class GoodViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
+    queryset = Good.objects.select_related('category', 'seller').prefetch_related('images__renditions').order_by('-id')
     serializer_class = GoodSerializer
     permission_classes = [IsSellerOnly, IsSellerAndOwnerOrReadOnly]
     pagination_class = CustomPagination
 
     def get_queryset(self):
         user = self.request.user
-        print(self.request.user, self.request.user.is_staff)
+        logger.debug('Товары продавца: user=%s is_staff=%s', user.pk, user.is_staff)
+        queryset = super().get_queryset()
         if user.is_staff:
-            return Good.objects.all()
-        return Good.objects.filter(seller=user)
+            return queryset
+        return queryset.filter(seller_id=user.pk)
 
     def perform_create(self, serializer):
-        serializer.save(seller=self.request.user)
+        serializer.save(seller_id=self.request.user.pk)
 
     def get_object(self):
         obj = super().get_object()
-        if not self.request.user.is_staff and obj.seller != self.request.user:
+        if not self.request.user.is_staff and obj.seller_id != self.request.user.pk:
             raise PermissionDenied("Вы не можете получить доступ к чужому товару.")
         return obj
 
-    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser])
-    def upload_image(self, request, pk=None):
-        good = self.get_object()
-
-        if good.seller != request.user:
+    def image_upload_denied(self, request, good):
+        if good.seller_id != request.user.pk:
             return Response({'detail': 'Вы не являетесь владельцем этого товара.'}, status=403)
 
-        if request.user.role not in ['seller', 'admin']:
+        if not roles.has_role(request.user, roles.SELLER, roles.ADMIN):
             return Response({'detail': 'Только продавец может загружать изображения.'}, status=403)
 
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser])
+    def upload_image(self, request, pk=None):
+        good = self.get_object()
+        denied = self.image_upload_denied(request, good)
+        if denied:
+            return denied
+
         images = request.FILES.getlist('image')
 
         if not images:
             return Response({'error': 'Файлы не переданы'}, status=400)
 
-        for img in images:
-            GoodImage.objects.create(good=good, image=img)
+        # Сохраняем только оригиналы, превью строятся в фоне (shop.tasks.generate_thumbnail)
+        created = create_good_images(good, images)
+
+        return Response({
+            'message': f'{len(images)} изображений загружено',
+            'images': GoodImageSerializer(created, many=True, context=self.get_serializer_context()).data
+        })
+
+    @action(detail=True, methods=['post'], url_path='upload-urls')
+    def upload_urls(self, request, pk=None):
+        """
+        Presigned POST для загрузки картинок напрямую в S3:
+        {"files": [{"name": "a.jpg", "contentType": "image/jpeg", "size": 123456}, ...]}
+        """
+        good = self.get_object()
+        denied = self.image_upload_denied(request, good)
+        if denied:
+            return denied
+
+        if direct_upload_storage() is None:
+            return Response({'error': 'Прямая загрузка в хранилище недоступна'}, status=400)
+
+        serializer = GoodImageUploadRequestSerializer(data=request.data.get('files'), many=True, allow_empty=False,
+                                                      max_length=50)
+        serializer.is_valid(raise_exception=True)
+
+        return Response({
+            'expiresIn': settings.IMAGE_DIRECT_UPLOAD_EXPIRES,
+            'uploads': [
+                presign_image_upload(good, item['name'], item['contentType'], item['size'])
+                for item in serializer.validated_data
+            ],
+        })
+
+    @action(detail=True, methods=['post'], url_path='finalize-upload')
+    def finalize_upload(self, request, pk=None):
+        """
+        Зарегистрировать загруженные напрямую файлы: {"keys": ["goods/uploads/1/....jpg", ...]}.
+        Превью и рендишены строятся в фоне.
+        """
+        good = self.get_object()
+        denied = self.image_upload_denied(request, good)
+        if denied:
+            return denied
 
-        return Response({'message': f'{len(images)} изображений загружено'})
+        serializer = GoodImageFinalizeSerializer(data=request.data, context={'good': good})
+        serializer.is_valid(raise_exception=True)
+        created = add_good_images(good, serializer.validated_data['keys'])
+
+        return Response({
+            'message': f'{len(created)} изображений загружено',
+            'images': GoodImageSerializer(created, many=True, context=self.get_serializer_context()).data
+        }, status=status.HTTP_201_CREATED)
 
 
 # --- Методы оплаты ---
@@ -220,39 +461,40 @@ class BasketItemViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return BasketItem.objects.filter(user=self.request.user)
+        return BasketItem.objects.filter(user=self.request.user).select_related('good')
 
-    def perform_create(self, serializer):
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         good = serializer.validated_data['good']
         count = serializer.validated_data['count']
-        user = self.request.user
 
         if count <= 0:
             raise serializers.ValidationError("Количество должно быть больше 0.")
 
-        existing = BasketItem.objects.filter(user=user, good=good).first()
-        if existing:
-            existing.count += count
-            existing.save()
-            raise serializers.ValidationError("Товар уже был в корзине — количество обновлено.")
-
-        serializer.save(user=user)
+        instance = BasketItem.objects.add(request.user, {good.pk: count})[good.pk]
+        instance.good = good
+        return Response(
+            self.get_serializer(instance).data,
+            status=status.HTTP_201_CREATED if instance.created else status.HTTP_200_OK
+        )
 
-    def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Добавить в корзину сразу много товаров (например, восстановить корзину после входа):
+        [{"goodId": 1, "count": 2}, ...]
+        """
+        serializer = BasketItemBulkAddSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        good = serializer.validated_data['good']
-        count = serializer.validated_data['count']
-        user = request.user
 
-        existing = BasketItem.objects.filter(user=user, good=good).first()
-        if existing:
-            existing.count += count
-            existing.save()
-            return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+        counts = {}
+        for item in serializer.validated_data:
+            counts[item['goodId']] = counts.get(item['goodId'], 0) + item['count']
+        BasketItem.objects.add(request.user, counts)
 
-        self.perform_create(serializer)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        items = self.get_queryset().filter(good_id__in=counts).select_related('good')
+        return Response(self.get_serializer(items, many=True).data, status=status.HTTP_200_OK)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -267,44 +509,51 @@ class BasketItemViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
 
-class CheckoutViewSet(viewsets.ModelViewSet):
+class CheckoutViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Checkout.objects.all()
     serializer_class = CheckoutSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Checkout.objects.filter(user=self.request.user)
+        return Checkout.objects.filter(user=self.request.user).prefetch_related('items').order_by('-id')
 
     def perform_create(self, serializer):
         user = self.request.user
-        basket_items = BasketItem.objects.filter(user=user)
 
-        if not basket_items.exists():
-            raise serializers.ValidationError("Корзина пуста")
+        with db_transaction.atomic():
+            # Блокируем строки корзины, чтобы параллельный запрос не оформил её второй раз
+            basket_items = list(
+                BasketItem.objects.select_for_update(of=('self',)).filter(user=user).select_related('good')
+            )
+            if not basket_items:
+                raise serializers.ValidationError("Корзина пуста")
 
-        total = sum(item.good.price * item.count for item in basket_items)
-        checkout = serializer.save(user=user, payment_total=total)
+            total = BasketItem.objects.filter(pk__in=[item.pk for item in basket_items]).aggregate(
+                total=Sum(
+                    F('good__price') * F('count'),
+                    output_field=DecimalField(max_digits=10, decimal_places=2)
+                )
+            )['total']
+            checkout = serializer.save(user=user, payment_total=total)
 
-        # Переносим товары из корзины в чекаут
-        for item in basket_items:
-            CheckoutItem.objects.create(
-                checkout=checkout,
-                good=item.good,
-                count=item.count
-            )
+            # Переносим товары из корзины в чекаут
+            CheckoutItem.objects.bulk_create([
+                CheckoutItem(checkout=checkout, good=item.good, count=item.count)
+                for item in basket_items
+            ])
 
-        # Очищаем корзину
-        basket_items.delete()
+            # Очищаем корзину
+            BasketItem.objects.filter(pk__in=[item.pk for item in basket_items]).delete()
 
 
 # --- Транзакции пользователя ---
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Transaction.objects.filter(checkout__user=self.request.user)
+        return Transaction.objects.filter(checkout__user=self.request.user).order_by('-id')
 
 
     def perform_create(self, serializer):
@@ -333,7 +582,8 @@ class TransactionViewSet(viewsets.ModelViewSet):
             checkout=checkout,
             amount=amount,
             status='created',
-            provider_data=payment.json()
+            provider_data=payment.json(),
+            provider_payment_id=payment.id
         )
 
         # ВАЖНО: записываем объект обратно в сериализатор
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import claims
+from .models import User
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    Пользователь из claims токена. pk, role и is_staff есть без запроса в базу;
+    любой другой атрибут, сравнение с моделью или передача в ORM один раз загружает User.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        user_id = token[api_settings.USER_ID_CLAIM]
+        super().__init__(lambda: self.load(user_id))
+        # Мимо LazyObject.__setattr__, который записал бы атрибуты в загруженного User
+        self.__dict__.update(
+            pk=user_id,
+            id=user_id,
+            role=token[claims.ROLE_CLAIM],
+            is_staff=token[claims.STAFF_CLAIM],
+        )
+
+    def __bool__(self):
+        return True
+
+    @staticmethod
+    def load(user_id):
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            raise AuthenticationFailed('Пользователь не найден.', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен.', code='user_inactive')
+        return user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication без запроса User на каждый запрос: роль и is_staff берутся из токена.
+    Токены без claims (выданные до их появления) и режим JWT_CLAIMS_AUTH=False
+    работают как раньше, через загрузку User.
+    """
+
+    def get_user(self, validated_token):
+        if claims.is_stale(validated_token):
+            raise InvalidToken('Роль пользователя изменилась, обновите токен.')
+        if not settings.JWT_CLAIMS_AUTH or claims.ROLE_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
@@ -0,0 +1,87 @@
+import re
+import time
+
+from django.core import mail
+from django.core.cache import cache
+from django.test import Client, override_settings
+
+from onlineStores.benchmark import Recorder, register
+from .claims import refresh_token_for
+from .models import User
+
+
+@register('auth_flow')
+@override_settings(OTP_IP_LIMIT=10 ** 6, OTP_CONFIRM_IP_LIMIT=10 ** 6)
+def auth_flow(size=None):
+    """
+    Вход по коду: запрос кода (письмо уходит в locmem), подтверждение, первый запрос с токеном.
+    Каждая итерация — новый пользователь, как при первом входе.
+    """
+    count = size or 50
+    cache.clear()
+    client = Client()
+    login, confirm, me = Recorder(), Recorder(), Recorder()
+
+    start = time.perf_counter()
+    for i in range(count):
+        email = f'bench-auth{i}@example.com'
+        with login.measure():
+            response = client.post('/api/v1/auth/login/', {'email': email}, content_type='application/json')
+        assert response.status_code == 200, response.content
+
+        code = re.search(r'\d{6}', mail.outbox[-1].body).group()
+        with confirm.measure():
+            response = client.post(
+                '/api/v1/auth/confirm/', {'email': email, 'code': code}, content_type='application/json',
+            )
+        assert response.status_code == 200, response.content
+
+        with me.measure():
+            response = client.get('/api/v1/auth/me/', HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        assert response.status_code == 200, response.content
+    seconds = time.perf_counter() - start
+
+    return {
+        'logins': count,
+        'emails_sent': len(mail.outbox),
+        'login': login.summary(),
+        'confirm': confirm.summary(),
+        'me': me.summary(),
+        'flows_per_second': round(count / seconds, 1),
+    }
+
+
+@register('token_refresh')
+def token_refresh(size=None):
+    """
+    Пропускная способность auth/refresh/: цепочки ротаций по нескольким пользователям
+    и отказ по уже использованному токену (проверка чёрного списка в кэше).
+    """
+    count = size or 500
+    users = User.objects.bulk_create(User(email=f'bench-refresh{i}@example.com') for i in range(10))
+    cache.clear()
+    client = Client()
+    refresh, reused = Recorder(), Recorder()
+    chains = [str(refresh_token_for(user)) for user in users]
+
+    start = time.perf_counter()
+    for i in range(count):
+        index = i % len(chains)
+        old = chains[index]
+        with refresh.measure():
+            response = client.post('/api/v1/auth/refresh/', {'refresh': old}, content_type='application/json')
+        assert response.status_code == 200, response.content
+        chains[index] = response.json()['refresh']
+
+        if i % 10 == 0:
+            with reused.measure():
+                response = client.post('/api/v1/auth/refresh/', {'refresh': old}, content_type='application/json')
+            assert response.status_code == 401, response.content
+    seconds = time.perf_counter() - start
+
+    return {
+        'refreshes': count,
+        'refresh': refresh.summary(),
+        'reused': reused.summary(),
+        'refreshes_per_second': round(count / seconds, 1),
+    }
@@ -0,0 +1,50 @@
+"""
+Роль и флаг is_staff в claims JWT, чтобы проверка прав не читала User из базы.
+
+Смена role, is_staff или is_active увеличивает User.claims_version и кладёт новую
+версию в кэш. Access-токен со старой версией отклоняется, и клиент обновляет пару
+через refresh (users/tokens.py), получая claims из базы. Если ключ вытеснен из кэша,
+устаревшие claims действуют не дольше ACCESS_TOKEN_LIFETIME.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.tokens import RefreshToken
+
+ROLE_CLAIM = 'role'
+STAFF_CLAIM = 'is_staff'
+VERSION_CLAIM = 'cv'
+
+# Поля User, которые попадают в токен или влияют на доступ
+CLAIMS_FIELDS = ('role', 'is_staff', 'is_active')
+
+
+def _version_key(user_id):
+    return f'users:claims_version:{user_id}'
+
+
+def refresh_token_for(user):
+    """
+    RefreshToken с claims роли; access_token копирует их из refresh.
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh[ROLE_CLAIM] = user.role
+    refresh[STAFF_CLAIM] = user.is_staff
+    refresh[VERSION_CLAIM] = user.claims_version
+    return refresh
+
+
+def publish_version(user):
+    """
+    Кладёт версию в кэш после коммита: при откате в кэше осталась бы версия,
+    которой нет в базе, и все токены пользователя, даже свежие, считались бы устаревшими.
+    """
+    # Проверяются только access-токены, дольше их жизни версию хранить незачем
+    timeout = int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
+    key, version = _version_key(user.pk), user.claims_version
+    transaction.on_commit(lambda: cache.set(key, version, timeout))
+
+
+def is_stale(token):
+    current = cache.get(_version_key(token['user_id']))
+    return current is not None and current != token.get(VERSION_CLAIM)
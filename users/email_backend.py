@@ -1,24 +1,111 @@
 import ssl
+import threading
+import time
+
 import certifi
 import smtplib
+from celery import current_task
+from django.conf import settings
 from django.core.mail.backends.smtp import EmailBackend
 
+# Открытые SMTP-соединения по (host, port, username), по одному на поток воркера
+_pool = threading.local()
+
 
 class CustomEmailBackend(EmailBackend):
+    """
+    SMTP_SSL с сертификатами certifi и переиспользованием соединения.
+
+    close() не закрывает соединение, а возвращает его в пул потока: следующая пачка писем
+    (задача djcelery_email) уходит без нового TLS-рукопожатия и логина. Соединение,
+    простоявшее дольше EMAIL_CONNECTION_MAX_IDLE, проверяется NOOP, а закрытое сервером
+    переоткрывается. Пул работает только в воркере Celery: в eager-режиме письма уходят
+    из веб-потоков, и там соединение закрывается сразу.
+    """
+
+    @property
+    def pool_key(self):
+        return self.host, self.port, self.username
+
+    def connect(self):
+        connection = smtplib.SMTP_SSL(
+            self.host,
+            self.port,
+            timeout=self.timeout,
+            context=ssl.create_default_context(cafile=certifi.where())
+        )
+        connection.ehlo()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        return connection
+
+    def take_pooled(self):
+        connections = getattr(_pool, 'connections', {})
+        pooled = connections.pop(self.pool_key, None)
+        if pooled is None:
+            return None
+        connection, last_used = pooled
+        if time.monotonic() - last_used < settings.EMAIL_CONNECTION_MAX_IDLE:
+            return connection
+        try:
+            if connection.noop()[0] == 250:
+                return connection
+        except smtplib.SMTPException:
+            pass
+        self.quit(connection)
+        return None
+
     def open(self):
         if self.connection:
             return False
         try:
-            self.connection = smtplib.SMTP_SSL(
-                self.host,
-                self.port,
-                timeout=self.timeout,
-                context=ssl.create_default_context(cafile=certifi.where())
-            )
-            self.connection.ehlo()
-            if self.username and self.password:
-                self.connection.login(self.username, self.password)
+            self.connection = self.take_pooled() or self.connect()
             return True
         except Exception:
             if not self.fail_silently:
                 raise
+
+    @staticmethod
+    def pooling_allowed():
+        # Только внутри задачи, выполняемой воркером, а не в потоке, который её вызвал
+        task = current_task
+        # current_task — прокси: вне задачи он ложен, а не None
+        return bool(task) and not task.request.is_eager and not task.request.called_directly
+
+    def close(self):
+        if self.connection is None:
+            return
+        with self._lock:
+            if not self.pooling_allowed():
+                self.discard()
+                return
+            if not hasattr(_pool, 'connections'):
+                _pool.connections = {}
+            replaced = _pool.connections.get(self.pool_key)
+            _pool.connections[self.pool_key] = (self.connection, time.monotonic())
+            self.connection = None
+        if replaced is not None:
+            self.quit(replaced[0])
+
+    def discard(self):
+        """
+        Закрыть текущее соединение насовсем (сервер оборвал его или оно в неизвестном состоянии).
+        """
+        if self.connection is not None:
+            self.quit(self.connection)
+            self.connection = None
+
+    def quit(self, connection):
+        try:
+            connection.quit()
+        except (ssl.SSLError, smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _send(self, email_message):
+        try:
+            return super()._send(email_message)
+        except smtplib.SMTPServerDisconnected:
+            # Сервер закрыл соединение между письмами — переподключаемся и повторяем один раз
+            self.discard()
+            self.connection = self.connect()
+            return super()._send(email_message)
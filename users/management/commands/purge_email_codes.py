@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.tasks import purge_expired_email_codes
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные коды из устаревшей таблицы EmailCode.'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_email_codes()
+        self.stdout.write(f'Удалено кодов: {deleted}')
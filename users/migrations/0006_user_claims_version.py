@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_user_role"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="claims_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -4,9 +4,12 @@ import string
 from django.contrib.auth.models import AbstractUser  # ✅ вот это важно!
 from django.contrib.auth.base_user import BaseUserManager
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
 
+from . import claims, roles
+
 
 class CustomUserManager(BaseUserManager):
     use_in_migrations = True
@@ -43,6 +46,8 @@ class User(AbstractUser):
         ('admin', 'Админ'),
     ]
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='buyer')
+    # Версия claims в JWT (users/claims.py): растёт при смене роли, is_staff или is_active
+    claims_version = models.PositiveIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -60,21 +65,51 @@ class User(AbstractUser):
         blank=True
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_claims = self.loaded_claims()
+
     def __str__(self):
         return self.email
 
+    def loaded_claims(self):
+        # Только загруженные поля: обращение к отложенному полю было бы лишним запросом
+        return {field: self.__dict__[field] for field in claims.CLAIMS_FIELDS if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        current = self.loaded_claims()
+        changed = self.pk is not None and any(
+            current.get(field, value) != value for field, value in self._saved_claims.items()
+        )
+        if changed:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'claims_version'}
+            self.claims_version = F('claims_version') + 1
+        super().save(*args, **kwargs)
+        if changed:
+            self.refresh_from_db(fields=['claims_version'])
+            claims.publish_version(self)
+        self._saved_claims = self.loaded_claims()
+
     @property
     def is_seller(self):
-        return self.groups.filter(name='seller').exists()
+        return roles.is_seller(self)
 
 
 class EmailCode(models.Model):
+    """
+    Устаревшее хранилище кодов входа: коды теперь в кэше (users/otp.py).
+    Остатки таблицы чистит задача users.tasks.purge_expired_email_codes.
+    """
+    LIFETIME = timedelta(minutes=5)
+
     email = models.EmailField(unique=True)
     code = models.CharField(max_length=6)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def is_valid(self):
-        return self.created_at >= timezone.now() - timedelta(minutes=5)
+        return self.created_at >= timezone.now() - self.LIFETIME
 
     def generate_code(self):
         self.code = ''.join(random.choices(string.digits, k=6))
@@ -0,0 +1,90 @@
+"""
+Одноразовые коды входа в кэше (Redis в проде) вместо таблицы EmailCode.
+
+Код хранится как HMAC от SECRET_KEY и живёт OTP_CODE_TTL секунд. Неверные попытки
+считаются атомарным cache.incr, после OTP_MAX_ATTEMPTS код сгорает. Выдача и проверка
+кодов ограничены по email и по IP окнами фиксированной длины.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CODE_LENGTH = 6
+
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+def _code_key(email):
+    return f'otp:code:{email}'
+
+
+def _attempts_key(email):
+    return f'otp:attempts:{email}'
+
+
+def _digest(email, code):
+    return hmac.new(settings.SECRET_KEY.encode(), f'{email}:{code}'.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_code(email):
+    """
+    Новый код для email. Прежний код и счётчик попыток сбрасываются.
+    """
+    code = ''.join(secrets.choice('0123456789') for _ in range(CODE_LENGTH))
+    cache.set_many({
+        _code_key(email): _digest(email, code),
+        _attempts_key(email): 0,
+    }, settings.OTP_CODE_TTL)
+    return code
+
+
+def verify_code(email, code):
+    """
+    Проверяет и гасит код. Код одноразовый: при двух одновременных верных
+    подтверждениях VALID получит только то, чьё удаление ключа прошло первым.
+    """
+    digest = cache.get(_code_key(email))
+    if digest is None:
+        return EXPIRED
+
+    try:
+        attempts = cache.incr(_attempts_key(email))
+    except ValueError:
+        # Счётчик вытеснен раньше кода — считаем код протухшим
+        return EXPIRED
+    if attempts > settings.OTP_MAX_ATTEMPTS:
+        cache.delete(_code_key(email))
+        return LOCKED
+
+    if not hmac.compare_digest(digest, _digest(email, str(code))):
+        return INVALID
+    if not cache.delete(_code_key(email)):
+        return EXPIRED
+    cache.delete(_attempts_key(email))
+    return VALID
+
+
+def hit_rate_limit(scope, ident, limit, window):
+    """
+    Считает обращение в окне фиксированной длины. Возвращает, через сколько секунд
+    можно повторить, если лимит превышен, иначе None.
+    """
+    now = int(time.time())
+    window_start = now - now % window
+    key = f'otp:rate:{scope}:{ident}:{window_start}'
+    cache.add(key, 0, window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, window)
+        count = 1
+    if count > limit:
+        return window_start + window - now
+    return None
@@ -0,0 +1,62 @@
+"""
+Роли пользователя для проверок прав: поле role плюс имена групп.
+
+Группы читаются из базы один раз и кэшируются (ROLES_CACHE_TIMEOUT), внутри запроса
+результат запоминается на объекте пользователя. Кэш сбрасывается при изменении
+состава групп и при переименовании или удалении группы (users/signals.py); role не
+кэшируется и читается с объекта. С ClaimsUser role берётся из токена, группы — из кэша,
+и User из базы не загружается.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+SELLER = 'seller'
+ADMIN = 'admin'
+
+
+def _groups_key(user_id):
+    return f'users:groups:{user_id}'
+
+
+def group_names(user):
+    """
+    Имена групп пользователя. Память запроса — в user.__dict__, мимо LazyObject.__setattr__.
+    """
+    if user.pk is None:
+        return frozenset()
+    names = user.__dict__.get('_group_names')
+    if names is None:
+        key = _groups_key(user.pk)
+        names = cache.get(key)
+        if names is None:
+            from .models import User
+            names = frozenset(User.groups.through.objects.filter(user_id=user.pk).values_list('group__name', flat=True))
+            cache.set(key, names, settings.ROLES_CACHE_TIMEOUT)
+        user.__dict__['_group_names'] = names
+    return names
+
+
+def has_role(user, *roles):
+    """
+    True, если role пользователя или одна из его групп совпадает с одной из ролей.
+    """
+    if not user or not user.is_authenticated:
+        return False
+    if user.role in roles:
+        return True
+    return not group_names(user).isdisjoint(roles)
+
+
+def is_seller(user):
+    return has_role(user, SELLER)
+
+
+def invalidate(*user_ids):
+    """
+    Сбросить закэшированные группы после коммита, чтобы параллельный запрос
+    не успел положить в кэш состояние до изменения.
+    """
+    keys = [_groups_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
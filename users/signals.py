@@ -0,0 +1,27 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import roles
+from .models import User
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        roles.invalidate(instance.pk)
+    elif action == 'pre_clear':
+        # После clear() со стороны группы pk_set пуст — участников собираем заранее
+        roles.invalidate(*instance.custom_user_set.values_list('pk', flat=True))
+    elif pk_set:
+        roles.invalidate(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_members(sender, instance, **kwargs):
+    # Переименование или удаление группы меняет роли всех её участников
+    if instance.pk is not None:
+        roles.invalidate(*instance.custom_user_set.values_list('pk', flat=True))
@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.utils import timezone
+
+from .models import EmailCode
+
+
+@shared_task
+def purge_expired_email_codes():
+    """
+    Таблица EmailCode больше не пополняется — удаляем просроченные коды, оставшиеся в ней.
+    """
+    deleted, _ = EmailCode.objects.filter(created_at__lt=timezone.now() - EmailCode.LIFETIME).delete()
+    return deleted
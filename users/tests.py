@@ -1,7 +1,31 @@
-from django.test import TestCase
+import re
+import smtplib
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
 import requests
 from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.core.mail import EmailMessage
 from django.urls import reverse
+from celery import current_task as celery_current_task
+from djcelery_email.tasks import send_emails
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from shop.permission import IsSellerOnly, IsSellerOrAdmin
+from . import claims, email_backend, roles
+from .authentication import ClaimsJWTAuthentication, ClaimsUser
+from .email_backend import CustomEmailBackend
+from .models import EmailCode, User
 
 
 class AuthAPITestCase(TestCase):
@@ -31,3 +55,381 @@ class AuthAPITestCase(TestCase):
         else:
             self.assertIn("error", response.json())
 
+
+@override_settings(
+    EMAIL_BACKEND='djcelery_email.backends.CeleryEmailBackend',
+    CELERY_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class LoginEmailQueueTestCase(TestCase):
+
+    def test_login_only_queues_the_code(self):
+        with mock.patch.object(send_emails, 'delay') as delay:
+            response = self.client.post(reverse('login'), {'email': 'buyer@example.com'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once()
+        messages = delay.call_args.args[0]
+        self.assertEqual(messages[0]['to'], ['buyer@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+    def test_worker_sends_queued_code(self):
+        # Без брокера задачи выполняются сразу (CELERY_TASK_ALWAYS_EAGER)
+        self.client.post(reverse('login'), {'email': 'buyer@example.com'}, content_type='application/json')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Ваш код', mail.outbox[0].body)
+
+
+class PooledEmailBackendTestCase(TestCase):
+
+    def setUp(self):
+        email_backend._pool.__dict__.clear()
+        self.addCleanup(email_backend._pool.__dict__.clear)
+        patcher = mock.patch('users.email_backend.smtplib.SMTP_SSL')
+        self.smtp = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connections = []
+        self.smtp.side_effect = self.new_connection
+        # Письма отправляет задача в воркере Celery
+        self.worker_task = mock.Mock()
+        self.worker_task.request.is_eager = False
+        self.worker_task.request.called_directly = False
+        patcher = mock.patch('users.email_backend.current_task', self.worker_task)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def new_connection(self, *args, **kwargs):
+        connection = mock.Mock()
+        connection.sendmail.return_value = {}
+        connection.noop.return_value = (250, b'OK')
+        self.connections.append(connection)
+        return connection
+
+    def send(self, count=1):
+        backend = CustomEmailBackend(host='smtp.test', port=465, username='shop', password='secret', use_ssl=True)
+        messages = [EmailMessage('Код', 'Ваш код: 1', 'shop@example.com', [f'user{i}@example.com']) for i in range(count)]
+        return backend.send_messages(messages)
+
+    def test_connection_is_reused_between_batches(self):
+        self.assertEqual(self.send(3), 3)
+        self.assertEqual(self.send(2), 2)
+        self.assertEqual(len(self.connections), 1)
+        self.connections[0].login.assert_called_once_with('shop', 'secret')
+        self.assertEqual(self.connections[0].sendmail.call_count, 5)
+        self.connections[0].quit.assert_not_called()
+
+    def test_reconnects_when_server_dropped_connection(self):
+        self.send()
+        self.connections[0].sendmail.side_effect = smtplib.SMTPServerDisconnected()
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(len(self.connections), 2)
+        self.connections[1].sendmail.assert_called_once()
+
+    def test_idle_connection_is_checked_before_reuse(self):
+        with mock.patch('users.email_backend.time.monotonic', return_value=0):
+            self.send()
+        self.connections[0].noop.return_value = (421, b'Timeout')
+        with mock.patch('users.email_backend.time.monotonic', return_value=settings.EMAIL_CONNECTION_MAX_IDLE + 1):
+            self.assertEqual(self.send(), 1)
+        self.connections[0].noop.assert_called_once()
+        self.connections[0].quit.assert_called_once()
+        self.assertEqual(len(self.connections), 2)
+
+    def test_connection_is_closed_outside_worker(self):
+        # В eager-режиме отправка идёт из веб-потока — соединение в пуле не остаётся
+        self.worker_task.request.is_eager = True
+        self.send()
+        # Вне задачи — настоящий прокси Celery без текущей задачи
+        with mock.patch('users.email_backend.current_task', celery_current_task):
+            self.send()
+        self.assertEqual(len(self.connections), 2)
+        for smtp in self.connections:
+            smtp.quit.assert_called_once()
+        self.assertFalse(getattr(email_backend._pool, 'connections', {}))
+
+
+class OtpLoginTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, email='buyer@example.com', ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'email': email}, content_type='application/json', REMOTE_ADDR=ip)
+
+    def confirm(self, code, email='buyer@example.com'):
+        return self.client.post(reverse('confirm'), {'email': email, 'code': code}, content_type='application/json')
+
+    def last_code(self):
+        return re.search(r'\d{6}', mail.outbox[-1].body).group()
+
+    def test_login_does_not_write_to_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(EmailCode.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_code_confirms_once(self):
+        self.login()
+        code = self.last_code()
+        response = self.confirm(code)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertTrue(User.objects.filter(email='buyer@example.com').exists())
+        self.assertEqual(self.confirm(code).status_code, 400)
+
+    def test_new_code_replaces_old_one(self):
+        self.login()
+        old = self.last_code()
+        self.login()
+        new = self.last_code()
+        if old != new:
+            self.assertEqual(self.confirm(old).status_code, 400)
+        self.assertEqual(self.confirm(new).status_code, 200)
+
+    @override_settings(OTP_MAX_ATTEMPTS=3)
+    def test_code_is_burned_after_too_many_attempts(self):
+        self.login()
+        code = self.last_code()
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(3):
+            self.assertEqual(self.confirm(wrong).status_code, 400)
+        response = self.confirm(code)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.confirm(code).status_code, 400)
+
+    def test_expired_code(self):
+        self.login()
+        cache.delete('otp:code:buyer@example.com')
+        self.assertEqual(self.confirm(self.last_code()).json()['error'], 'Код истёк.')
+
+    @override_settings(OTP_EMAIL_LIMIT=2)
+    def test_login_is_limited_per_email(self):
+        self.assertEqual(self.login(ip='10.0.0.1').status_code, 200)
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+        response = self.login(ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.login(email='other@example.com').status_code, 200)
+
+    @override_settings(OTP_IP_LIMIT=2)
+    def test_login_is_limited_per_ip(self):
+        self.assertEqual(self.login(email='a@example.com').status_code, 200)
+        self.assertEqual(self.login(email='b@example.com').status_code, 200)
+        self.assertEqual(self.login(email='c@example.com').status_code, 429)
+        self.assertEqual(self.login(email='c@example.com', ip='10.0.0.9').status_code, 200)
+
+    def test_purge_removes_only_expired_legacy_codes(self):
+        fresh = EmailCode.objects.create(email='fresh@example.com', code='123456')
+        stale = EmailCode.objects.create(email='stale@example.com', code='123456')
+        EmailCode.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        call_command('purge_email_codes', stdout=mock.Mock())
+        self.assertEqual(list(EmailCode.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+class ClaimsAuthenticationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='seller@example.com', role='seller')
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def test_tokens_carry_role_claims(self):
+        access = claims.refresh_token_for(self.user).access_token
+        self.assertEqual(access['role'], 'seller')
+        self.assertIs(access['is_staff'], False)
+        self.assertEqual(access['cv'], 0)
+
+    def test_claims_user_does_not_hit_database(self):
+        token = claims.refresh_token_for(self.user).access_token
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+            self.assertIsInstance(user, ClaimsUser)
+            self.assertEqual((user.pk, user.role, user.is_staff), (self.user.pk, 'seller', False))
+            self.assertTrue(user and user.is_authenticated)
+        # Остальные поля загружают пользователя один раз
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'seller@example.com')
+            self.assertEqual(user, self.user)
+
+    @override_settings(JWT_CLAIMS_AUTH=False)
+    def test_claims_auth_can_be_disabled(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate(claims.refresh_token_for(self.user).access_token)
+        self.assertIsInstance(user, User)
+
+    def test_token_without_claims_loads_user(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate(RefreshToken.for_user(self.user).access_token)
+        self.assertIsInstance(user, User)
+
+    def test_role_change_invalidates_tokens(self):
+        old = claims.refresh_token_for(self.user).access_token
+        self.user.role = 'buyer'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['role'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.claims_version, 1)
+
+        with self.assertRaises(InvalidToken):
+            self.authenticate(old)
+        user = self.authenticate(claims.refresh_token_for(self.user).access_token)
+        self.assertEqual(user.role, 'buyer')
+
+        response = self.client.get('/api/v1/auth/me/', HTTP_AUTHORIZATION=f'Bearer {old}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_unrelated_changes_keep_tokens(self):
+        token = claims.refresh_token_for(self.user).access_token
+        self.user.first_name = 'Иван'
+        self.user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).claims_version, 0)
+        self.assertEqual(self.authenticate(token).pk, self.user.pk)
+
+    def test_deactivated_user_is_rejected(self):
+        token = claims.refresh_token_for(self.user).access_token
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+
+    def test_rolled_back_role_change_keeps_tokens(self):
+        token = claims.refresh_token_for(self.user).access_token
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.user.role = 'buyer'
+                self.user.save()
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(User.objects.get(pk=self.user.pk).claims_version, 0)
+        self.assertEqual(self.authenticate(token).role, 'seller')
+
+
+class RolesTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name='seller')
+        self.user = User.objects.create_user(email='user@example.com')
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_groups_are_cached_across_requests(self):
+        self.user.groups.add(self.group)
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_seller)
+        # В пределах запроса — память на объекте, между запросами — кэш
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_seller)
+            self.assertTrue(roles.has_role(user, roles.SELLER, roles.ADMIN))
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_seller)
+
+    def test_permissions_with_claims_user_do_not_hit_database(self):
+        self.user.groups.add(self.group)
+        roles.group_names(self.fresh_user())
+        token = claims.refresh_token_for(self.user).access_token
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        request.user = ClaimsJWTAuthentication().authenticate(request)[0]
+        with self.assertNumQueries(0):
+            self.assertTrue(IsSellerOrAdmin().has_permission(request, None))
+            self.assertTrue(IsSellerOnly().has_permission(request, None))
+
+    def test_role_field_needs_no_group_lookup(self):
+        self.user.role = 'seller'
+        self.user.save()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.user.is_seller)
+
+    def test_group_membership_change_invalidates_cache(self):
+        self.assertFalse(self.fresh_user().is_seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(self.fresh_user().is_seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.custom_user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().is_seller)
+
+    def test_group_clear_and_rename_invalidate_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(self.fresh_user().is_seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = 'former-seller'
+            self.group.save()
+        self.assertFalse(self.fresh_user().is_seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = 'seller'
+            self.group.save()
+        self.assertTrue(self.fresh_user().is_seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.custom_user_set.clear()
+        self.assertFalse(self.fresh_user().is_seller)
+
+
+class RefreshTokenTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='buyer@example.com')
+        self.refresh = claims.refresh_token_for(self.user)
+
+    def post(self, refresh):
+        return self.client.post(reverse('token_refresh'), {'refresh': str(refresh)}, content_type='application/json')
+
+    def test_refresh_rotates_tokens(self):
+        with self.assertNumQueries(1):
+            response = self.post(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertNotEqual(data['refresh'], str(self.refresh))
+        new = RefreshToken(data['refresh'])
+        self.assertEqual(new['user_id'], self.user.pk)
+        self.assertNotEqual(new['jti'], self.refresh['jti'])
+        me = self.client.get('/api/v1/auth/me/', HTTP_AUTHORIZATION=f"Bearer {data['access']}")
+        self.assertEqual(me.json()['email'], 'buyer@example.com')
+
+    def test_rotated_token_cannot_be_reused(self):
+        response = self.post(self.refresh)
+        self.assertEqual(self.post(self.refresh).status_code, 401)
+        self.assertEqual(self.post(response.json()['refresh']).status_code, 200)
+
+    def test_blacklist_entry_lives_until_token_expiry(self):
+        with mock.patch('users.tokens.cache.add', return_value=True) as add:
+            self.post(self.refresh)
+        key, value, timeout = add.call_args.args
+        self.assertIn(self.refresh['jti'], key)
+        lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds()
+        self.assertAlmostEqual(timeout, lifetime, delta=5)
+        self.assertIsNone(cache.get(key))
+        self.post(self.refresh)
+        self.assertIsNotNone(cache.get(key))
+
+    def test_refresh_picks_up_role_change(self):
+        self.user.role = 'seller'
+        self.user.save()
+        access = RefreshToken(self.post(self.refresh).json()['refresh']).access_token
+        self.assertEqual(access['role'], 'seller')
+        self.assertEqual(access['cv'], 1)
+
+    def test_invalid_tokens_are_rejected(self):
+        self.assertEqual(self.client.post(reverse('token_refresh'), {}, content_type='application/json').status_code, 400)
+        self.assertEqual(self.post('garbage').status_code, 401)
+        self.assertEqual(self.post(self.refresh.access_token).status_code, 401)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.post(self.refresh).status_code, 401)
+
+    def test_expired_access_header_is_ignored(self):
+        response = self.client.post(
+            reverse('token_refresh'), {'refresh': str(self.refresh)}, content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer expired',
+        )
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,45 @@
+"""
+Ротация refresh-токенов с чёрным списком в кэше вместо таблиц приложения token_blacklist.
+
+Использованный refresh-токен попадает в кэш по jti ровно на оставшийся срок жизни:
+после exp он отклоняется и так, поэтому список не растёт. В Redis для этого кэша
+нужна политика вытеснения, не трогающая ключи с TTL раньше срока (noeviction или
+volatile-ttl на отдельной базе), иначе вытесненный jti снова станет годным.
+"""
+import time
+
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import claims
+from .models import User
+
+
+def _blacklist_key(jti):
+    return f'users:blacklist:{jti}'
+
+
+def blacklist(token):
+    """
+    Вносит токен в чёрный список до его exp. False, если он уже там: cache.add атомарен,
+    поэтому из двух одновременных обновлений одним токеном пройдёт только одно.
+    """
+    timeout = token['exp'] - int(time.time())
+    if timeout <= 0:
+        return False
+    return cache.add(_blacklist_key(token['jti']), 1, timeout)
+
+
+def rotate(raw_token):
+    """
+    Новая пара токенов по refresh-токену. Claims перечитываются из базы,
+    так что смена роли доходит до клиента при следующем обновлении.
+    """
+    refresh = RefreshToken(raw_token)
+    if not blacklist(refresh):
+        raise TokenError('Токен уже использован.')
+    user = User.objects.filter(pk=refresh['user_id'], is_active=True).first()
+    if user is None:
+        raise TokenError('Пользователь не найден или неактивен.')
+    return claims.refresh_token_for(user)
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import LoginView, ConfirmView, MeView
+from .views import LoginView, ConfirmView, MeView, RefreshView
 
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('confirm/', ConfirmView.as_view(), name='confirm'),
+    path('refresh/', RefreshView.as_view(), name='token_refresh'),
     path('me/', MeView.as_view()),
 ]
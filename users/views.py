@@ -3,16 +3,21 @@ from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.throttling import BaseThrottle
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import EmailCode, User
+from .models import User
+from . import claims, otp, tokens
 from .serializers import EmailSerializer
 from rest_framework import status
+from rest_framework_simplejwt.exceptions import TokenError
 from django.core.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 
-import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class MeView(APIView):
     permission_classes = [IsAuthenticated]
@@ -23,38 +28,79 @@ class MeView(APIView):
             "role": request.user.role
         })
 
+
+class RefreshView(APIView):
+    """
+    Обменивает refresh-токен на новую пару. Старый refresh попадает в чёрный список
+    (users/tokens.py) и повторно не принимается.
+    """
+    permission_classes = [AllowAny]
+    # Просроченный access в заголовке не должен мешать обновлению
+    authentication_classes = []
+
+    def post(self, request):
+        raw_token = request.data.get('refresh')
+        if not raw_token:
+            return Response({"error": "Не передан refresh-токен."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            refresh = tokens.rotate(raw_token)
+        except TokenError:
+            return Response({"error": "Недействительный refresh-токен."}, status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response({
+            "access": str(refresh.access_token),
+            "refresh": str(refresh),
+        }, status=status.HTTP_200_OK)
+
+
+def client_ip(request):
+    # Учитывает NUM_PROXIES из настроек DRF, если приложение стоит за прокси
+    return BaseThrottle().get_ident(request)
+
+
+def too_many_requests(message, retry_after):
+    return Response({"error": message}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    headers={'Retry-After': str(retry_after)})
+
+
 class LoginView(APIView):
+    """
+    Выдаёт одноразовый код. Код живёт в кэше (users/otp.py), пользователь создаётся
+    только при подтверждении — запрос кода не пишет в базу.
+    """
     permission_classes = [AllowAny]
 
     def post(self, request):
         serializer = EmailSerializer(data=request.data)
         if serializer.is_valid():
             email = serializer.validated_data['email']
-            try:
-                user, created = User.objects.get_or_create(email=email)
 
-                EmailCode.objects.filter(email=email).delete()
-                email_code = EmailCode.objects.create(email=email)
-                email_code.generate_code()
+            retry_after = (
+                otp.hit_rate_limit('login-ip', client_ip(request), settings.OTP_IP_LIMIT, settings.OTP_RATE_WINDOW)
+                or otp.hit_rate_limit('login-email', email, settings.OTP_EMAIL_LIMIT, settings.OTP_RATE_WINDOW)
+            )
+            if retry_after:
+                return too_many_requests("Слишком много запросов кода. Попробуйте позже.", retry_after)
+
+            try:
+                code = otp.issue_code(email)
 
                 send_mail(
                     'Ваш одноразовый код',
-                    f'Ваш код: {email_code.code}',
+                    f'Ваш код: {code}',
                     settings.DEFAULT_FROM_EMAIL,
                     [email],
                     fail_silently=False,
                 )
-                print(f'Ваш код: {email_code.code}')
+                # Код в логе нужен только для локальной разработки без почты — уровень DEBUG
+                logger.debug('Код для %s: %s', email, code)
 
                 return Response({"message": "Код отправлен на email."}, status=status.HTTP_200_OK)
 
 
             except Exception as e:
-
-                print("Произошла ошибка:")
-
-                traceback.print_exc()  # Покажет полный стек трейс
-
+                logger.exception('Не удалось отправить код на %s', email)
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -67,20 +113,29 @@ class ConfirmView(APIView):
         email = request.data.get('email')
         code = request.data.get('code')
 
-        try:
-            email_code = EmailCode.objects.get(email=email, code=code)
-        except EmailCode.DoesNotExist:
+        retry_after = otp.hit_rate_limit(
+            'confirm-ip', client_ip(request), settings.OTP_CONFIRM_IP_LIMIT, settings.OTP_RATE_WINDOW
+        )
+        if retry_after:
+            return too_many_requests("Слишком много попыток. Попробуйте позже.", retry_after)
+
+        if not email or not code:
             return Response({"error": "Неверный код."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not email_code.is_valid():
+        result = otp.verify_code(email, code)
+        if result == otp.LOCKED:
+            return too_many_requests("Слишком много неверных попыток. Запросите новый код.", settings.OTP_CODE_TTL)
+        if result == otp.EXPIRED:
             return Response({"error": "Код истёк."}, status=status.HTTP_400_BAD_REQUEST)
+        if result != otp.VALID:
+            return Response({"error": "Неверный код."}, status=status.HTTP_400_BAD_REQUEST)
 
         user, created = User.objects.get_or_create(email=email)
         if created:
             user.set_unusable_password()
             user.save()
 
-        refresh = RefreshToken.for_user(user)
+        refresh = claims.refresh_token_for(user)
         access_token = refresh.access_token
 
         return Response({